@@ -0,0 +1,74 @@
+# Recall@k and query latency of the local IVF index (utils/local_vector_store.py) for several nprobe values,
+# against exact brute-force search over the same store. Vectors are drawn around random cluster centres, which is
+# roughly how document embeddings are distributed, so no embeddings API is needed.
+#
+#   python -m benchmarks.ann_recall --rows 100000 --dim 1536
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from utils.local_vector_store import LocalVectorStore
+
+
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        raise NotImplementedError
+
+
+def clustered(rng, centres, n, noise):
+    vectors = centres[rng.integers(0, len(centres), n)] + noise * rng.standard_normal((n, centres.shape[1]))
+    return vectors.astype(np.float32)
+
+
+def timed_search(store, queries, k, **kwargs):
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        hits = store.similarity_search_with_score_by_vector(query, k=k, **kwargs)
+        latencies.append(time.perf_counter() - started)
+        results.append({doc.page_content for doc, _ in hits})
+    return results, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=1.0, help="spread of the points around their cluster centre")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.standard_normal((args.clusters, args.dim))
+    with tempfile.TemporaryDirectory() as path:
+        store = LocalVectorStore(NoEmbeddings(), path=path)
+        started = time.perf_counter()
+        for start in range(0, args.rows, 10000):
+            n = min(10000, args.rows - start)
+            store.add_embeddings([str(i) for i in range(start, start + n)], clustered(rng, centres, n, args.noise))
+        print(f"indexed {args.rows} x {args.dim} in {time.perf_counter() - started:.1f}s, "
+              f"{len(store._centroids)} lists")
+
+        queries = clustered(rng, centres, args.queries, args.noise)
+        truth, latencies = timed_search(store, queries, args.k, exact=True)
+        print(f"{'search':<12} {'recall@' + str(args.k):>9} {'p50':>9} {'p95':>9}")
+        print(f"{'exact':<12} {1.0:>9.3f} {statistics.median(latencies) * 1000:>7.2f}ms "
+              f"{np.percentile(latencies, 95) * 1000:>7.2f}ms")
+        for nprobe in args.nprobe:
+            found, latencies = timed_search(store, queries, args.k, nprobe=nprobe)
+            recall = statistics.mean(len(f & t) / len(t) for f, t in zip(found, truth))
+            print(f"{'nprobe=' + str(nprobe):<12} {recall:>9.3f} {statistics.median(latencies) * 1000:>7.2f}ms "
+                  f"{np.percentile(latencies, 95) * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
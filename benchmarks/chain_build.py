@@ -0,0 +1,70 @@
+# Per-message setup cost of the Agent and Retriever Chain pages: building the agent executor (retriever tool,
+# prompt, ChatOpenAI client, bind_tools) or the retrieval chain for every message, as the Agent page used to,
+# versus looking up the instance built once in the registry. Building needs no network; pass --fake-llm where
+# langchain-openai is not installed to time everything but the client itself.
+#
+#   python -m benchmarks.chain_build --messages 50
+import argparse
+import statistics
+import time
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+import utils.create_chains as create_chains
+from utils.registry import get_chain, invalidate
+
+
+class FakeToolChatModel(FakeListChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+
+def fake_chat_llm(provider, api_key, temperature=0.5, streaming=False, **kwargs):
+    return FakeToolChatModel(responses=["ok"])
+
+
+class FakeVectorStore:
+    def similarity_search(self, query, k=4, **kwargs):
+        return []
+
+
+def time_ms(function, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(0.95 * (len(samples) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--fake-llm", action="store_true")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        create_chains.get_chat_llm = fake_chat_llm
+    store = FakeVectorStore()
+    api_key = "sk-benchmark"
+
+    def rebuild(create_chain):
+        # The old per-message path: a fresh LLM client as well as a fresh chain.
+        def run():
+            invalidate("llm")
+            create_chain(store, api_key)
+        return run
+
+    print(f"{'chain':<16} {'mode':<22} {'p50':>9} {'p95':>9}")
+    for name, create_chain in [("agent executor", create_chains.create_agent_executor),
+                               ("retriever chain", create_chains.create_retriever_chain)]:
+        for mode, run in [("rebuild per message", rebuild(create_chain)),
+                          ("registry (built once)", lambda: get_chain(create_chain, store, api_key))]:
+            p50, p95 = time_ms(run, args.messages)
+            print(f"{name:<16} {mode:<22} {p50:>7.3f}ms {p95:>7.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Tokens of chat history sent with each request over a long conversation: the previous unbounded list of turns
+# versus HistoryManager (last turns verbatim, older turns folded into a summary). Without --openai-key the summary
+# is the extractive fallback; with a key, older turns are summarized by --summary-model, as on the pages.
+#
+#   python -m benchmarks.chat_history --turns 50
+import argparse
+import random
+import time
+
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+from utils.chat_history import HistoryManager, create_history_manager
+from utils.context_packer import count_tokens
+
+TOPICS = ["asthma", "type 2 diabetes", "migraine", "hypertension", "gout", "anemia", "kidney stones", "the flu"]
+SENTENCES = ["It is a common condition that affects people of all ages.", "Symptoms can vary from person to person.",
+             "Doctors usually recommend lifestyle changes first.", "Medication may be needed in some cases.",
+             "Regular check-ups help to monitor the condition.", "Early diagnosis improves outcomes."]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--max-tokens", type=int, default=1500)
+    parser.add_argument("--openai-key")
+    parser.add_argument("--summary-model", default="gpt-3.5-turbo")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    if args.openai_key:
+        manager = create_history_manager(args.openai_key, args.summary_model, max_tokens=args.max_tokens)
+    else:
+        manager = HistoryManager(max_tokens=args.max_tokens)
+    unbounded = []
+    fold_seconds = 0.0
+    checkpoints = {5, 10, 25, 50, 100, args.turns}
+
+    print(f"{'turn':>5} {'unbounded':>10} {'managed':>8}")
+    for turn in range(1, args.turns + 1):
+        topic = rng.choice(TOPICS)
+        question = f"What should I know about {topic}?"
+        answer = f"{topic.capitalize()}: " + " ".join(rng.choice(SENTENCES) for _ in range(rng.randint(8, 20)))
+        unbounded.append((question, answer))
+        manager.add_turn(question, answer)
+        started = time.perf_counter()
+        # The pages do not wait; waiting here makes every row reflect a settled summary.
+        manager.wait()
+        fold_seconds += time.perf_counter() - started
+        if turn in checkpoints:
+            print(f"{turn:>5} {count_tokens(_get_chat_history(unbounded)):>10} "
+                  f"{count_tokens(_get_chat_history(manager.messages())):>8}")
+    print(f"summary folding: {fold_seconds:.2f}s in total, off the request path")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# Chunking throughput in MB/s on generated text (paragraphs of sentences, the odd long unbroken token): the previous
+# RecursiveCharacterTextSplitter(800, 200) versus TextChunker in character and token mode, with the number of chunks
+# and the characters in them (what gets embedded and stored, overlaps included). Each size is split --repeat times
+# and the best run is kept. The splitter re-splits and re-joins pieces once per separator level and measures every
+# merge; TextChunker finds every split point in one pass per separator. Token mode needs tiktoken's vocabulary;
+# without it, sizes fall back to 4 characters per token.
+#
+#   python -m benchmarks.chunking --sizes 1 10 50
+import argparse
+import random
+import time
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from utils.chunking import TextChunker
+
+WORDS = ("patient symptoms treatment diagnosis chronic acute infection inflammation therapy dose medication risk "
+         "condition blood pressure heart lung kidney liver pain fever fatigue").split()
+
+
+def make_text(size_mb, seed=0):
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    paragraphs = []
+    length = 0
+    while length < target:
+        sentences = []
+        for _ in range(rng.randint(2, 12)):
+            words = [rng.choice(WORDS) for _ in range(rng.randint(5, 30))]
+            if rng.random() < 0.01:
+                words.append("x" * rng.randint(200, 3000))  # a URL, a table row, base64...
+            sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+        paragraph = " ".join(sentences) if rng.random() < 0.7 else "\n".join(sentences)
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def best_time(split, text, repeat):
+    best, chunks = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        chunks = split(text)
+        best = min(best, time.perf_counter() - started)
+    return best, chunks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50], help="text sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=200, help="chunk size in token mode")
+    args = parser.parse_args()
+
+    splitters = [
+        ("RecursiveCharacterTextSplitter", RecursiveCharacterTextSplitter(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap, length_function=len).split_text),
+        ("TextChunker, chars", TextChunker(args.chunk_size, args.chunk_overlap).split_text),
+        (f"TextChunker, {args.tokens} tokens",
+         TextChunker(args.tokens, args.tokens * args.chunk_overlap // args.chunk_size, mode="tokens").split_text),
+    ]
+    print(f"{'size':>7} {'splitter':<32} {'chunks':>8} {'chars':>10} {'mean len':>9} {'time':>8} {'MB/s':>7}")
+    for size_mb in args.sizes:
+        text = make_text(size_mb)
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+        for label, split in splitters:
+            elapsed, chunks = best_time(split, text, args.repeat)
+            chars = sum(map(len, chunks))
+            print(f"{mb:>5.1f}MB {label:<32} {len(chunks):>8} {chars:>10} {chars / max(len(chunks), 1):>9.0f} "
+                  f"{elapsed:>7.2f}s {mb / elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# Prompt context size and retention of the relevant passage for three ways of handing retrieved chunks to the
+# answer prompt: stuffing everything, the previous max_tokens_limit=150 (drop chunks from the end until the rest
+# fits), and the token-budgeted ContextPacker. Each query retrieves 8 synthetic chunks of varying length, some of
+# them near-duplicates, with the sentence that answers the query planted in one of the top 4.
+#
+#   python -m benchmarks.context_packing --budget 3000
+import argparse
+import random
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from utils.context_packer import ContextPacker, count_tokens
+
+FILLER = ["The condition affects people of all ages.", "Doctors recommend regular check-ups.",
+          "Symptoms can vary from person to person.", "Lifestyle changes are often advised.",
+          "Early diagnosis improves outcomes.", "Some patients report mild discomfort.",
+          "Further research is ongoing in this area.", "Family history can play a role."]
+
+
+def make_query(rng, i):
+    drug = f"drug{i}mab"
+    answer = f"The recommended first-line treatment for condition{i} is {drug} twice daily."
+    chunks = []
+    for _ in range(8):
+        chunks.append(" ".join(rng.choice(FILLER) for _ in range(rng.randint(5, 80))))
+    # Near-duplicates, as when the same article is scraped from two URLs.
+    chunks[5] = chunks[1] + " Updated."
+    chunks[6] = chunks[2]
+    target = rng.randrange(4)
+    sentences = chunks[target].split(". ")
+    sentences.insert(rng.randrange(len(sentences) + 1), answer)
+    chunks[target] = ". ".join(sentences)
+    return f"what is the first-line treatment for condition{i}", [Document(page_content=c) for c in chunks], answer
+
+
+def limit_tokens(documents, limit):
+    # ConversationalRetrievalChain._reduce_tokens_below_limit
+    tokens = [count_tokens(doc.page_content) for doc in documents]
+    num_docs = len(documents)
+    total = sum(tokens)
+    while total > limit and num_docs:
+        num_docs -= 1
+        total -= tokens[num_docs]
+    return documents[:num_docs]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--budget", type=int, default=3000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = [make_query(rng, i) for i in range(args.queries)]
+    packer = ContextPacker(token_budget=args.budget)
+    strategies = {
+        "stuff everything": lambda query, documents: documents,
+        "max_tokens_limit=150": lambda query, documents: limit_tokens(documents, 150),
+        f"packer ({args.budget} tokens)": packer.pack,
+    }
+
+    print(f"{'strategy':<24} {'tokens p50':>10} {'tokens max':>10} {'answer kept':>11} {'time p50':>9}")
+    for name, strategy in strategies.items():
+        sizes, kept, times = [], 0, []
+        for query, documents, answer in queries:
+            started = time.perf_counter()
+            context = strategy(query, documents)
+            times.append(time.perf_counter() - started)
+            sizes.append(sum(count_tokens(doc.page_content) for doc in context))
+            kept += any(answer in doc.page_content for doc in context)
+        print(f"{name:<24} {statistics.median(sizes):>10.0f} {max(sizes):>10} {kept / len(queries):>11.0%} "
+              f"{statistics.median(times) * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Crawl time against local HTTP servers (one per "host", each answering after --latency-ms and supporting ETags):
+# the previous scrape_link (2 s sleep, fetched with requests, then downloaded again for parsing, one URL per call)
+# versus the concurrent crawler, cold and on a second pass where every page answers 304 Not Modified.
+#
+#   python -m benchmarks.crawler --urls 60 --hosts 4
+import argparse
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from utils.crawler import Crawler, Validators
+
+PAGE = "<html><head><title>Page {n}</title></head><body><article>" + "<p>Healthcare article text.</p>" * 200 + \
+       "</article></body></html>"
+
+
+def make_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            body = PAGE.format(n=self.path).encode("utf-8")
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def old_scrape(url, sleep):
+    time.sleep(sleep)
+    session = requests.Session()
+    if session.get(url, timeout=10).status_code == 200:
+        requests.get(url, timeout=10)  # newspaper's Article.download()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--urls", type=int, default=60)
+    parser.add_argument("--hosts", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--host-interval", type=float, default=0.1)
+    parser.add_argument("--old-sleep", type=float, default=2.0)
+    parser.add_argument("--old-urls", type=int, default=3, help="URLs timed with the old path, then extrapolated")
+    args = parser.parse_args()
+
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), make_handler(args.latency_ms / 1000)) for _ in range(args.hosts)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{servers[i % args.hosts].server_port}/page/{i}" for i in range(args.urls)]
+    cache = tempfile.mkdtemp()
+    try:
+        started = time.perf_counter()
+        for url in urls[:args.old_urls]:
+            old_scrape(url, args.old_sleep)
+        old = (time.perf_counter() - started) / args.old_urls
+        print(f"old scrape_link: {old:.2f}s per URL, about {old * len(urls):.0f}s for {len(urls)} URLs")
+
+        crawler = Crawler(host_interval=args.host_interval, validators=Validators(f"{cache}/crawl.sqlite3"))
+        for label in ("crawler, cold", "crawler, unchanged (304)"):
+            started = time.perf_counter()
+            results = crawler.crawl(urls)
+            elapsed = time.perf_counter() - started
+            for result in results:
+                if result.ok:
+                    crawler.validators.remember(result)
+            fetched = sum(result.ok for result in results)
+            not_modified = sum(result.not_modified for result in results)
+            print(f"{label}: {elapsed:.2f}s for {len(urls)} URLs ({fetched} fetched, {not_modified} not modified, "
+                  f"{sum(bool(result.error) for result in results)} errors)")
+    finally:
+        for server in servers:
+            server.shutdown()
+        shutil.rmtree(cache)
+
+
+if __name__ == "__main__":
+    main()
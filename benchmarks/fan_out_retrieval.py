@@ -0,0 +1,117 @@
+# Retrieval latency of the history-aware chain: the previous serial stage (LLM rewrite, then one dense search)
+# against FanOutRetriever (dense and keyword searches for the original question started alongside the rewrite,
+# then dense and keyword searches for the rewrite), and, for a question that needs no rewrite, a dense search followed
+# by a keyword search against both run together. The store, the keyword index and the LLM are local fakes whose
+# latencies are drawn from a log-normal distribution around --search-ms, --keyword-ms and --rewrite-ms, so tail
+# effects of waiting on several searches show up in p95.
+#
+#   python -m benchmarks.fan_out_retrieval --queries 200
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from utils.retrievers import FanOutRetriever
+from utils.tracing import StageStats, TraceHandler
+
+
+def jittered(ms):
+    return random.lognormvariate(0, 0.35) * ms / 1000
+
+
+class FakeStore:
+    def __init__(self, search_ms):
+        self.search_ms = search_ms
+
+    def similarity_search(self, query, k=4, **kwargs):
+        time.sleep(jittered(self.search_ms))
+        return [Document(page_content=f"{query} {i}") for i in range(k)]
+
+    async def asimilarity_search(self, query, k=4, **kwargs):
+        await asyncio.sleep(jittered(self.search_ms))
+        return [Document(page_content=f"{query} {i}") for i in range(k)]
+
+
+class FakeKeywordIndex:
+    def __init__(self, search_ms):
+        self.search_ms = search_ms
+
+    def search(self, query, k=4):
+        time.sleep(jittered(self.search_ms))
+        return [(Document(page_content=f"{query} {i}"), 1.0) for i in range(k)]
+
+
+class SlowChatModel(FakeListChatModel):
+    delay: float = 0.3
+
+    def _call(self, *args, **kwargs):
+        time.sleep(jittered(self.delay * 1000))
+        return super()._call(*args, **kwargs)
+
+    async def _acall(self, *args, **kwargs):
+        await asyncio.sleep(jittered(self.delay * 1000))
+        return super()._call(*args, **kwargs)
+
+
+def summary(latencies):
+    return (f"{statistics.median(latencies) * 1000:>7.0f}ms "
+            f"{sorted(latencies)[int(0.95 * (len(latencies) - 1))] * 1000:>7.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--search-ms", type=float, default=120)
+    parser.add_argument("--keyword-ms", type=float, default=20)
+    parser.add_argument("--rewrite-ms", type=float, default=400)
+    args = parser.parse_args()
+
+    store = FakeStore(args.search_ms)
+    keyword_index = FakeKeywordIndex(args.keyword_ms)
+    llm = SlowChatModel(responses=["diabetes treatment options"], delay=args.rewrite_ms / 1000)
+    prompt = ChatPromptTemplate.from_messages([MessagesPlaceholder(variable_name="chat_history"),
+                                               ("human", "{input}")])
+    rewrite_chain = prompt | llm
+    inputs = {"input": "what are the options?", "chat_history": [HumanMessage(content="I have diabetes")]}
+    # A question that needs no rewrite: serially this is one dense and one keyword search.
+    standalone = {"input": "What are the treatment options for type 2 diabetes?", "chat_history": []}
+
+    serial = []
+    for _ in range(args.queries):
+        started = time.perf_counter()
+        store.similarity_search(rewrite_chain.invoke(inputs).content)
+        serial.append(time.perf_counter() - started)
+    serial_standalone = []
+    for _ in range(args.queries):
+        started = time.perf_counter()
+        store.similarity_search(standalone["input"])
+        keyword_index.search(standalone["input"])
+        serial_standalone.append(time.perf_counter() - started)
+
+    stats = StageStats()
+    tracer = TraceHandler(stats=stats)
+    retriever = FanOutRetriever(store, keyword_index, llm=llm, prompt=prompt, name="fan-out").as_runnable()
+    for _ in range(args.queries):
+        retriever.invoke(inputs, config={"callbacks": [tracer]})
+    fan_out_standalone = []
+    for _ in range(args.queries):
+        started = time.perf_counter()
+        retriever.invoke(standalone)
+        fan_out_standalone.append(time.perf_counter() - started)
+
+    print(f"{'retrieval':<30} {'p50':>9} {'p95':>9}")
+    print(f"{'no rewrite: serial':<30} {summary(serial_standalone)}")
+    print(f"{'no rewrite: fan-out':<30} {summary(fan_out_standalone)}")
+    print(f"{'serial rewrite+search':<30} {summary(serial)}")
+    for stage, (p50, p95, _) in sorted(stats.latencies().items()):
+        print(f"{stage.replace('/', ' '):<30} {p50 * 1000:>7.0f}ms {p95 * 1000:>7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Parse time of the healthcare corpus: the previous loaders (JSONLoader with jq, one file after another, and the
+# json.load based parser of the bulk pipeline) versus the streaming record loader, in one process and through the
+# process pool of the bulk ingestion pipeline (with an embedder and a store that do nothing). Runs on --data when it
+# exists (the scraped ../data corpus), else on generated disease records of the same shape. Nothing is embedded or
+# written.
+#
+#   python -m benchmarks.healthcare_loader --data ../data --workers 4
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from utils.bulk_ingest import run_bulk_ingest
+from utils.load_healthcare_data import list_files, load_records
+
+WORDS = ("patient symptoms treatment diagnosis chronic acute infection inflammation therapy dose medication risk "
+         "condition blood pressure heart lung kidney liver pain fever fatigue").split()
+
+
+def write_corpus(folder, files, records):
+    rng = random.Random(0)
+    for n in range(files):
+        data = []
+        for i in range(records):
+            data.append({
+                "name": f"Disease {n}-{i}",
+                "link": f"https://example.org/diseases/{n}/{i}",
+                "overview": " ".join(rng.choice(WORDS) for _ in range(rng.randint(50, 200))),
+                "symptoms": [" ".join(rng.choice(WORDS) for _ in range(3)) for _ in range(rng.randint(3, 12))],
+                "treatment": " ".join(rng.choice(WORDS) for _ in range(rng.randint(30, 120))),
+            })
+        with open(os.path.join(folder, f"disease_{n:05d}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+
+def metadata_func(record, metadata):
+    metadata["source"] = record.get("link")
+    return metadata
+
+
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        return [[] for _ in texts]
+
+
+def jsonloader(file_paths):
+    from langchain_community.document_loaders import JSONLoader
+
+    return sum(len(JSONLoader(file_path=path, jq_schema='.[]', text_content=False, metadata_func=metadata_func).load())
+               for path in file_paths)
+
+
+def json_load(file_paths):
+    count = 0
+    for path in file_paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        records = data if isinstance(data, list) else list(data.values())
+        count += len([(json.dumps(record) if record else "", metadata_func(record, {}) if isinstance(record, dict)
+                       else {}) for record in records])
+    return count
+
+
+def streaming(file_paths):
+    return sum(len(load_records(path)) for path in file_paths)
+
+
+def pipeline(file_paths, workers):
+    stats = run_bulk_ingest(file_paths, load_records, NoEmbeddings(), None, parse_workers=workers,
+                            write_batch=lambda texts, vectors, metadatas, ids: None)
+    return stats.parsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default="../data")
+    parser.add_argument("--files", type=int, default=2000, help="generated files when --data does not exist")
+    parser.add_argument("--records", type=int, default=20, help="records per generated file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    workdir = None
+    if os.path.isdir(args.data):
+        folder = args.data
+    else:
+        workdir = tempfile.mkdtemp()
+        folder = workdir
+        write_corpus(folder, args.files, args.records)
+    try:
+        file_paths = list_files([folder])
+        size_mb = sum(os.path.getsize(path) for path in file_paths) / (1024 * 1024)
+        print(f"{len(file_paths)} files, {size_mb:.1f}MB{' (generated)' if workdir else ''}")
+        runs = [
+            ("JSONLoader (jq)", jsonloader),
+            ("json.load parser", json_load),
+            ("streaming loader, 1 process", streaming),
+            (f"bulk pipeline, {args.workers} workers", lambda paths: pipeline(paths, args.workers)),
+        ]
+        baseline = None
+        for label, run in runs:
+            try:
+                started = time.perf_counter()
+                count = run(file_paths)
+                elapsed = time.perf_counter() - started
+            except ImportError as e:
+                print(f"{label:<32} skipped ({e})")
+                continue
+            baseline = baseline or elapsed
+            print(f"{label:<32} {count:>8} records {elapsed:>7.2f}s {count / elapsed:>9.0f} records/s "
+                  f"{baseline / elapsed:>5.1f}x")
+    finally:
+        if workdir:
+            shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Latency of the keyword side of the hybrid retriever (utils/bm25_index.py) and of reciprocal rank fusion, on a
+# synthetic corpus shaped like the healthcare records: a few hundred common words plus disease names, drug names
+# and ICD-10 codes. Build time and index size are reported as well. No embeddings API is needed.
+#
+#   python -m benchmarks.hybrid_search --docs 100000
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.bm25_index import BM25Index
+from utils.retrievers import reciprocal_rank_fusion
+
+
+def make_corpus(rng, docs, words_per_doc):
+    common = [f"word{i}" for i in range(500)]
+    names = [f"disease{i}" for i in range(5000)] + [f"drug{i}mab" for i in range(5000)]
+    codes = [f"{chr(65 + i % 26)}{i % 100:02d}.{i % 10}" for i in range(5000)]
+    common_ids = rng.integers(0, len(common), (docs, words_per_doc))
+    name_ids = rng.integers(0, len(names), (docs, 3))
+    code_ids = rng.integers(0, len(codes), (docs, 2))
+    texts = [" ".join([common[i] for i in c] + [names[i] for i in n] + [codes[i] for i in d])
+             for c, n, d in zip(common_ids, name_ids, code_ids)]
+    return texts, names, codes, common
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--words", type=int, default=120, help="common words per document")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    texts, names, codes, common = make_corpus(rng, args.docs, args.words)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "bm25.sqlite3")
+        index = BM25Index(path)
+        started = time.perf_counter()
+        for start in range(0, len(texts), 1000):
+            batch = texts[start:start + 1000]
+            index.add([str(i) for i in range(start, start + len(batch))], batch)
+        built = time.perf_counter() - started
+        started = time.perf_counter()
+        BM25Index(path)
+        reloaded = time.perf_counter() - started
+        print(f"{args.docs} docs indexed in {built:.1f}s, reloaded in {reloaded:.1f}s, "
+              f"{os.path.getsize(path) / 1e6:.0f} MB on disk")
+
+        queries = [f"what is the treatment for {rng.choice(names)} {rng.choice(codes)} "
+                   f"{' '.join(rng.choice(common, 3))}" for _ in range(args.queries)]
+        index.search(queries[0], k=args.k)
+        ids_latencies, doc_latencies, fusion_latencies = [], [], []
+        for query in queries:
+            started = time.perf_counter()
+            index.search_ids(query, k=args.k)
+            ids_latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            keyword = [doc for doc, _ in index.search(query, k=args.k)]
+            doc_latencies.append(time.perf_counter() - started)
+            dense = [Document(page_content=texts[i]) for i in rng.integers(0, len(texts), args.k)]
+            started = time.perf_counter()
+            reciprocal_rank_fusion([dense, keyword], 4)
+            fusion_latencies.append(time.perf_counter() - started)
+
+        print(f"{'stage':<22} {'p50':>9} {'p95':>9}")
+        for name, latencies in (("bm25 ranking", ids_latencies),
+                                ("bm25 with documents", doc_latencies),
+                                ("rank fusion", fusion_latencies)):
+            print(f"{name:<22} {statistics.median(latencies) * 1000:>7.2f}ms "
+                  f"{np.percentile(latencies, 95) * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Cold import time of the chain module with eager provider imports (the previous layout of
+# utils/create_chains.py) versus the lazy provider factory.
+#
+#   python -m benchmarks.import_time --runs 5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "eager (all providers at import)": "import langchain_openai, langchain_google_genai, langchain_anthropic\n"
+                                       "from langchain_community.llms import CTransformers\n"
+                                       "import utils.create_chains",
+    "lazy (no provider yet)": "import utils.create_chains",
+    "lazy + first OpenAI client": "import utils.create_chains\n"
+                                  "from utils.llm_factory import get_chat_llm\n"
+                                  "get_chat_llm('OpenAI', 'sk-benchmark')",
+}
+
+
+def time_import(code):
+    script = "import time\nstart = time.perf_counter()\n" + code + "\nprint(time.perf_counter() - start)"
+    # Every run is a fresh interpreter so nothing is served from sys.modules.
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for name, code in SCENARIOS.items():
+        samples = [time_import(code) for _ in range(args.runs)]
+        results[name] = statistics.median(samples)
+        print(f"{name:<36} median {results[name] * 1000:8.1f} ms  (min {min(samples) * 1000:.1f} ms)")
+
+    eager = results["eager (all providers at import)"]
+    lazy = results["lazy (no provider yet)"]
+    print(f"cold page import is {eager / lazy:.2f}x faster ({(eager - lazy) * 1000:.1f} ms saved)")
+
+
+if __name__ == "__main__":
+    main()
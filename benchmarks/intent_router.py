@@ -0,0 +1,73 @@
+# Share of a labelled message mix that the intent router (utils/intent_router.py) answers locally, how long routing
+# takes, and how many healthcare questions it would wrongly answer from a template. The keyword rules always run;
+# pass --openai-key to add the embedding classifier (OpenAI embeddings, cached under .cache/ like the pages).
+#
+#   python -m benchmarks.intent_router --llm-ms 2500
+import argparse
+import time
+
+from utils.intent_router import IntentRouter, RouterStats
+
+# (message, intent the chain would have answered with; None for real healthcare questions)
+MESSAGES = [
+    ("hi", "greeting"), ("Hello there!", "greeting"), ("hey, how are you doing today?", "greeting"),
+    ("Good morning", "greeting"), ("hello, who are you?", "greeting"), ("thanks!", "thanks"),
+    ("Thank you so much, that was helpful", "thanks"), ("ok thanks", "thanks"), ("great, I appreciate it", "thanks"),
+    ("bye", "goodbye"), ("see you later, take care", "goodbye"), ("What's the weather like in Boston?", "off_topic"),
+    ("who won the NBA finals?", "off_topic"), ("recommend a movie for tonight", "off_topic"),
+    ("what is the price of bitcoin today", "off_topic"), ("write a poem about autumn", "off_topic"),
+    ("what's the capital of Australia?", "off_topic"), ("tell me a joke", "off_topic"),
+    ("What are the symptoms of asthma?", None), ("How is type 2 diabetes diagnosed?", None),
+    ("hi, what causes migraines?", None), ("thanks, and how is it treated?", None),
+    ("Does cold weather make asthma worse?", None), ("Can stress cause high blood pressure?", None),
+    ("I have had a sore throat and fever for three days", None), ("What are the side effects of metformin?", None),
+    ("Is it safe to exercise during pregnancy?", None), ("How long does the flu last?", None),
+    ("what foods should people with gout avoid", None), ("my knee hurts when I run", None),
+    ("What is the ICD-10 code for hypertension?", None), ("can a snake bite be dangerous?", None),
+    ("Which vitamins help with anemia?", None), ("Are movies bad for children's eyes?", None),
+    ("What causes kidney stones?", None), ("How can I sleep better at night?", None),
+    ("is ibuprofen safe with alcohol", None), ("What is the best diet for heart health?", None),
+    ("What are the early signs of Parkinson's?", None), ("How contagious is chickenpox?", None),
+    ("Can cold weather make my joints hurt?", None), ("Does weather affect migraines?", None),
+    ("I got hurt playing soccer, what should I do?", None), ("Is it safe to play football after a concussion?", None),
+    ("my kid swallowed a lottery ticket", None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--openai-key")
+    parser.add_argument("--llm-ms", type=float, default=2500, help="latency of retrieval plus one chain call")
+    args = parser.parse_args()
+
+    embedding = None
+    if args.openai_key:
+        from langchain_openai import OpenAIEmbeddings
+        from utils.embedding_cache import CachedEmbeddings
+        embedding = CachedEmbeddings(OpenAIEmbeddings(openai_api_key=args.openai_key))
+    stats = RouterStats()
+    router = IntentRouter(embedding, stats=stats)
+
+    wrong, missed, times = [], [], []
+    for message, expected in MESSAGES:
+        started = time.perf_counter()
+        routed = router.route(message)
+        times.append(time.perf_counter() - started)
+        intent = routed[0] if routed else None
+        if intent and not expected:
+            wrong.append(message)
+        elif expected and not intent:
+            missed.append(message)
+    times.sort()
+    small_talk = sum(expected is not None for _, expected in MESSAGES)
+    print(f"{len(MESSAGES)} messages, {small_talk} of them small talk or off-topic "
+          f"({'rules + classifier' if embedding else 'rules only'})")
+    print(stats)
+    print(f"routing p50 {times[len(times) // 2] * 1e6:.1f}us, max {times[-1] * 1e6:.1f}us; "
+          f"about {sum(stats.handled.values()) * args.llm_ms / 1000:.1f}s of chain calls saved")
+    print(f"healthcare questions answered from a template: {len(wrong)} {wrong}")
+    print(f"small talk sent to the chain: {len(missed)} {missed}")
+
+
+if __name__ == "__main__":
+    main()
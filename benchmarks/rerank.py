@@ -0,0 +1,69 @@
+# Rerank stage: prompt tokens and answer retention when the chains pass the top 8 retrieved chunks (no reranker)
+# versus reranking 20 over-fetched candidates and passing the best 4, plus per-query rerank time. Candidates are
+# synthetic: the chunk that answers the query lands at a random retrieval rank among distractors that share some
+# of its terms. Add --cross-encoder to also time the optional cross-encoder (needs sentence-transformers).
+#
+#   python -m benchmarks.rerank --queries 500
+import argparse
+import random
+import statistics
+import time
+
+from langchain_core.documents import Document
+
+from utils.context_packer import ContextPacker
+from utils.reranker import CrossEncoderReranker, LexicalReranker
+
+FILLER = ("Patients should talk to their doctor about any concerns. Regular exercise and a balanced diet support "
+          "overall health. Many conditions share similar early signs. ")
+
+
+def make_query(rng, i):
+    condition, drug = f"condition{i}", f"drug{i}mab"
+    answer = Document(page_content=f"{FILLER}The first-line treatment for {condition} is {drug}, taken twice daily. "
+                                   f"Treatment of {condition} is reviewed after three months.")
+    distractors = [
+        Document(page_content=FILLER * rng.randint(1, 3) + rng.choice([
+            f"{condition} is more common in older adults.",
+            f"Symptoms of {condition} include fatigue and headaches.",
+            "The first-line treatment for migraine is rest and hydration.",
+            f"{drug} was first approved in 2015.",
+            "Treatment plans differ between patients.",
+        ]))
+        for _ in range(19)
+    ]
+    candidates = distractors[:]
+    candidates.insert(rng.randrange(20), answer)
+    return f"What is the first-line treatment for {condition}?", candidates, answer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--cross-encoder", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    queries = [make_query(rng, i) for i in range(args.queries)]
+    packer = ContextPacker(token_budget=3000)
+    strategies = {"top 8, no rerank": (None, 8), "lexical rerank 20 -> 4": (LexicalReranker(), 4)}
+    if args.cross_encoder:
+        strategies["cross-encoder 20 -> 4"] = (CrossEncoderReranker(), 4)
+
+    print(f"{'strategy':<24} {'tokens p50':>10} {'answer kept':>11} {'rerank p50':>10} {'rerank p95':>10}")
+    for name, (reranker, k) in strategies.items():
+        tokens, kept, times = [], 0, []
+        for query, candidates, answer in queries:
+            started = time.perf_counter()
+            documents = reranker.rerank(query, candidates, k) if reranker else candidates[:k]
+            times.append(time.perf_counter() - started)
+            packed = packer.pack(query, documents)
+            tokens.append(sum(doc.metadata["tokens"] for doc in packed))
+            kept += any(answer.page_content in doc.page_content for doc in packed)
+        times.sort()
+        print(f"{name:<24} {statistics.median(tokens):>10.0f} {kept / len(queries):>11.0%} "
+              f"{statistics.median(times) * 1000:>8.2f}ms {times[int(0.95 * (len(times) - 1))] * 1000:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# How often the rewrite gate (utils/rewrite_gate.py) skips the history-rewrite LLM call on a set of labelled chat
+# turns, how often it skips a turn that did need rewriting, and the latency that saves at a given rewrite cost.
+#
+#   python -m benchmarks.rewrite_gate --rewrite-ms 900
+import argparse
+import time
+
+from utils.chat_history import HistoryManager
+from utils.rewrite_gate import needs_rewrite
+
+history = HistoryManager()
+history.add_turn("What is type 2 diabetes?", "Type 2 diabetes is a chronic condition ...")
+HISTORY = history.messages()
+
+# (question, needs the conversation to be understood)
+TURNS = [
+    ("What are the symptoms of asthma?", False),
+    ("How is type 2 diabetes diagnosed?", False),
+    ("What are the side effects of metformin?", False),
+    ("Can children get migraines?", False),
+    ("What is the ICD-10 code for hypertension?", False),
+    ("How long does the flu last?", False),
+    ("Is chickenpox contagious before the rash appears?", False),
+    ("What foods should people with gout avoid?", False),
+    ("Which vitamins help with anemia?", False),
+    ("What causes kidney stones?", False),
+    ("Hello!", False),
+    ("Thanks for the help", False),
+    ("What are its complications?", True),
+    ("Is it hereditary?", True),
+    ("How is it treated?", True),
+    ("What about in children?", True),
+    ("and the symptoms?", True),
+    ("Tell me more", True),
+    ("Can those be prevented?", True),
+    ("What medication is used for that?", True),
+    ("treatment?", True),
+    ("Are there other risk factors?", True),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rewrite-ms", type=float, default=900, help="latency of one rewrite call")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    decisions = [needs_rewrite(question, HISTORY) for question, _ in TURNS]
+    gate_ms = (time.perf_counter() - started) * 1000 / len(TURNS)
+
+    skipped = decisions.count(False)
+    wrong_skips = [question for (question, needed), rewrite in zip(TURNS, decisions) if needed and not rewrite]
+    extra_rewrites = [question for (question, needed), rewrite in zip(TURNS, decisions) if rewrite and not needed]
+    print(f"{len(TURNS)} follow-up turns, gate takes {gate_ms:.3f} ms per turn")
+    print(f"rewrites skipped: {skipped} ({skipped / len(TURNS):.0%}), "
+          f"saving {skipped * args.rewrite_ms / 1000:.1f}s ({skipped * args.rewrite_ms / len(TURNS):.0f} ms per turn)")
+    print(f"skipped although needed: {len(wrong_skips)} {wrong_skips}")
+    print(f"rewritten although self-contained: {len(extra_rewrites)} {extra_rewrites}")
+    # The first turn of every conversation never needs a rewrite either.
+    print(f"first turn skipped: {not needs_rewrite(TURNS[0][0], [])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Render calls, characters pushed to the page and CPU time for the previous per-token StreamHandler versus the
+# buffered one, for answers of growing length. Handler CPU is the time spent in the callbacks, not counting the
+# renders; render CPU is the time the container spends serialising the element on each update, which is where
+# buffering saves work (the handler itself costs the same either way). Token arrival is simulated with a fake clock
+# (--token-ms apart), so the run takes no wall time beyond the handler and render work itself.
+#
+#   python -m benchmarks.stream_render --token-ms 20
+import argparse
+import json
+import time
+
+from utils.streaming import StreamHandler
+
+
+class CountingContainer:
+    def __init__(self):
+        self.calls = 0
+        self.chars = 0
+        self.seconds = 0.0
+
+    def markdown(self, text):
+        # Streamlit builds and serialises a new element with the full text on every update; a JSON message stands in
+        # for that cost.
+        started = time.process_time()
+        message = json.dumps({"delta": {"new_element": {"markdown": {"body": text}}}}).encode("utf-8")
+        self.seconds += time.process_time() - started
+        self.calls += 1
+        self.chars += len(message)
+
+
+class PerTokenStreamHandler:
+    # The handler as it was before buffering: concatenate and re-render on every token.
+    def __init__(self, container, initial_text=""):
+        self.container = container
+        self.text = initial_text
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        self.container.markdown(self.text)
+
+    def on_llm_end(self, response, **kwargs):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(make_handler, tokens, token_seconds):
+    container = CountingContainer()
+    clock = FakeClock()
+    handler = make_handler(container, clock)
+    started = time.process_time()
+    for token in tokens:
+        clock.now += token_seconds
+        handler.on_llm_new_token(token)
+    handler.on_llm_end(None)
+    return container.calls, container.chars, time.process_time() - started - container.seconds, container.seconds
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--token-ms", type=float, default=20.0, help="simulated gap between tokens")
+    args = parser.parse_args()
+
+    handlers = {
+        "per-token": lambda container, clock: PerTokenStreamHandler(container),
+        "buffered": lambda container, clock: StreamHandler(container, clock=clock),
+    }
+    print(f"{'tokens':>6} {'handler':<10} {'renders':>8} {'chars sent':>12} {'handler cpu':>11} {'render cpu':>10}")
+    for length in (250, 500, 1000, 2000):
+        tokens = [f"word{i % 97} " for i in range(length)]
+        for name, make_handler in handlers.items():
+            calls, chars, handler_cpu, render_cpu = run(make_handler, tokens, args.token_ms / 1000)
+            print(f"{length:>6} {name:<10} {calls:>8} {chars:>12} "
+                  f"{handler_cpu * 1000:>9.2f}ms {render_cpu * 1000:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Time-to-first-token and total latency of create_conversational_retrieval_chain, blocking versus streaming, for
+# each provider. The provider clients are replaced by a local fake chat model whose first-token delay and
+# per-token delay roughly follow the hosted models, so no API keys or network are needed.
+#
+#   python -m benchmarks.streaming_latency --runs 3
+import argparse
+import statistics
+import time
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel, generate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.retrievers import BaseRetriever
+
+import utils.create_chains as create_chains
+
+# (first token delay, per token delay) in seconds.
+PROVIDER_PROFILES = {
+    'OpenAI': (0.6, 0.02),
+    'Google': (0.8, 0.015),
+    'Claude': (1.2, 0.03),
+}
+
+ANSWER = ("Common symptoms of type 2 diabetes include increased thirst, frequent urination, increased hunger, "
+          "unintended weight loss, fatigue, blurred vision and slow-healing sores. Source: https://example.org ") * 3
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    first_token_delay: float
+    token_delay: float
+    streaming: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def get_num_tokens(self, text: str) -> int:
+        # The chain trims retrieved documents to a token budget; the default counter needs transformers.
+        return len(text.split())
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(ANSWER.split(" ")):
+            if i:
+                time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token + " "))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.streaming:
+            return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+        tokens = ANSWER.split(" ")
+        time.sleep(self.first_token_delay + self.token_delay * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=ANSWER))])
+
+
+class FixedRetriever(BaseRetriever):
+    documents: List[Document]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.documents
+
+
+class FakeVectorStore:
+    documents = [Document(page_content="Diabetes symptoms ...", metadata={"source": "https://example.org"})]
+
+    def as_retriever(self, **kwargs):
+        return FixedRetriever(documents=self.documents)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.documents[:k]
+
+
+class LatencyRecorder(BaseCallbackHandler):
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+
+def fake_chat_llm(provider, api_key, temperature=0.5, streaming=False, **kwargs):
+    first_token_delay, token_delay = PROVIDER_PROFILES[provider]
+    return FakeStreamingChatModel(first_token_delay=first_token_delay, token_delay=token_delay, streaming=streaming)
+
+
+def measure(model, streaming):
+    chain = create_chains.create_conversational_retrieval_chain(FakeVectorStore(), "", "", "",
+                                                                model=model, streaming=streaming)
+    recorder = LatencyRecorder()
+    chain({"question": "What are the symptoms of diabetes?", "chat_history": []}, callbacks=[recorder])
+    total = time.perf_counter() - recorder.started
+    # Without streaming nothing can be rendered before the chain returns.
+    ttft = recorder.first_token_at - recorder.started if recorder.first_token_at else total
+    return ttft, total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    create_chains.get_chat_llm = fake_chat_llm
+    print(f"{'provider':<8} {'mode':<10} {'TTFT p50':>10} {'total p50':>10}")
+    for model in PROVIDER_PROFILES:
+        for streaming in (False, True):
+            samples = [measure(model, streaming) for _ in range(args.runs)]
+            ttft = statistics.median(sample[0] for sample in samples)
+            total = statistics.median(sample[1] for sample in samples)
+            mode = "streaming" if streaming else "blocking"
+            print(f"{model:<8} {mode:<10} {ttft * 1000:>8.0f}ms {total * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
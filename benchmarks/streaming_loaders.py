@@ -0,0 +1,106 @@
+# Peak RSS of ingesting a large CSV upload: the previous path (load_and_split holds every row and chunk before
+# anything is written) versus the lazy loaders (chunks are produced as the file is read and flushed to the store in
+# bounded batches). Each run is a fresh process; the store and the keyword index discard what they are given, so
+# only the loading path is measured. The old path is only run up to --old-max-mb, as it needs several times the
+# file size in memory.
+#
+#   python -m benchmarks.streaming_loaders --sizes 50 100 500
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("patient symptoms treatment diagnosis chronic acute infection inflammation therapy dose medication risk "
+         "condition blood pressure heart lung kidney liver pain fever fatigue").split()
+
+
+class NullStore:
+    def add_texts(self, texts, metadatas=None, ids=None):
+        return ids
+
+    def delete(self, ids):
+        pass
+
+
+class NullIndex:
+    def add(self, ids, texts, metadatas):
+        pass
+
+    def delete(self, ids):
+        pass
+
+
+def write_csv(path, size_mb):
+    rng = random.Random(0)
+    target = size_mb * 1024 * 1024
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,condition,description\n")
+        row = 0
+        while f.tell() < target:
+            lines = []
+            for _ in range(1000):
+                description = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+                lines.append(f"{row},condition {row % 5000},{description}\n")
+                row += 1
+            f.write("".join(lines))
+
+
+def child(mode, path, cache):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.document_loaders.csv_loader import CSVLoader
+
+    from utils.data_loader import iter_file_chunks
+    from utils.manifest import Manifest, sync_source
+
+    manifest = Manifest(os.path.join(cache, f"{mode}_{os.path.basename(path)}.sqlite3"))
+    started = time.perf_counter()
+    if mode == "old":
+        splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=200, length_function=len)
+        docs = CSVLoader(path, encoding="utf-8").load_and_split(splitter)
+        chunks = ((doc.page_content, {**doc.metadata, "source": "upload.csv"}) for doc in docs)
+    else:
+        chunks = iter_file_chunks(path, "upload.csv")
+    result = sync_source(NullStore(), "upload.csv", chunks, digest=mode, manifest=manifest, keyword_index=NullIndex())
+    elapsed = time.perf_counter() - started
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{result.added} {elapsed} {peak_mb}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 500], help="CSV sizes in MB")
+    parser.add_argument("--old-max-mb", type=int, default=100)
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"{'CSV size':>8} {'path':<24} {'chunks':>9} {'time':>8} {'peak RSS':>10}")
+        for size_mb in args.sizes:
+            path = os.path.join(workdir, f"upload_{size_mb}.csv")
+            write_csv(path, size_mb)
+            for mode, label in [("old", "load_and_split"), ("lazy", "lazy, batched flushes")]:
+                if mode == "old" and size_mb > args.old_max_mb:
+                    print(f"{size_mb:>6}MB {label:<24} {'skipped':>9}")
+                    continue
+                output = subprocess.run([sys.executable, "-m", "benchmarks.streaming_loaders", "--child", mode, path,
+                                         workdir], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+                chunks, elapsed, peak_mb = output.split()[-3:]
+                print(f"{size_mb:>6}MB {label:<24} {int(chunks):>9} {float(elapsed):>7.1f}s {float(peak_mb):>8.0f}MB")
+            os.unlink(path)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
 import streamlit as st
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
 
-from utils.data_loader import populate_vector_store, scrape_link
-from utils.initialize_vector_store import initialize_vector_store
+from utils.data_loader import scrape_link
+from utils.ingestion_jobs import get_ingestion_queue, show_ingestion_progress
+from utils.registry import get_chain, get_resource, get_vector_store
 from utils.create_chains import create_conversational_retrieval_chain
+from utils.semantic_cache import cached_conversational_answer, get_semantic_cache
+from utils.streaming import StreamHandler
 
-from trulens_eval import TruChain, OpenAI, Tru
-from trulens_eval.feedback.provider.openai import OpenAI as fOpenAI
-from trulens_eval import Feedback
-import numpy as np
+from utils.feedback import FeedbackWorker, create_recorder
+from utils.rewrite_gate import rewrite_stats
+from utils.chat_history import create_history_manager
+from utils.intent_router import get_intent_router, router_stats
+from utils.tracing import get_tracer, show_stage_latencies
+
+from trulens_eval import Tru
 
 
 if 'tru_initialized' not in st.session_state:
@@ -21,7 +27,9 @@ else:
 st.session_state['tru'] = tru
 
 if 'google_chat_history' not in st.session_state:
-    st.session_state['google_chat_history'] = []
+    st.session_state['google_chat_history'] = create_history_manager(st.secrets.get('OPENAI_API_KEY'),
+                                                                     st.secrets.get('SUMMARY_MODEL', 'gpt-3.5-turbo'),
+                                                                     max_tokens=st.secrets.get('HISTORY_TOKENS', 1500))
 if "google_messages" not in st.session_state:
     st.session_state.google_messages = []
 
@@ -37,20 +45,29 @@ Helpful Answer:"""
 
 
 def main():
-    astra_vector_store = initialize_vector_store(st.secrets['ASTRA_DB_APPLICATION_TOKEN'], st.secrets['ASTRA_DB_ID'])
+    astra_vector_store = get_vector_store(st.secrets.get('ASTRA_DB_APPLICATION_TOKEN'), st.secrets.get('ASTRA_DB_ID'),
+                                          backend=st.secrets.get('VECTOR_STORE_BACKEND', 'astra'))
     st.set_page_config(page_title="Healthcare Chatbot", page_icon=":robot_face:")
     st.header('Gemini Healthcare Chatbot')
     with st.sidebar:
+        st.metric("Rewrites Skipped", rewrite_stats.skipped,
+                  help=f"{rewrite_stats.rewritten} rewritten, about {rewrite_stats.saved_seconds:.1f}s saved")
+        st.metric("History Tokens", st.session_state['google_chat_history'].token_count(),
+                  help="Last turns verbatim, older turns summarized")
+        st.metric("Answered Locally", f"{router_stats.handled_fraction:.0%}", help=str(router_stats))
+        show_stage_latencies()
         with st.container(border=True):
             st.markdown("### Upload Files")
             uploaded_files = st.file_uploader("Upload a file",
                                               accept_multiple_files=True,
                                               type=['csv', 'pdf', 'json', 'html', 'md'],
                                               label_visibility='hidden')
-            if uploaded_files:
-                for uploaded_file in uploaded_files:
-                    populate_vector_store(uploaded_file, astra_vector_store)
-                    st.success(f"Processed file {uploaded_file.name}. You may ask me questions about the file now.")
+            # Ingested in the background; rerunning with the same uploads does not submit them again.
+            ingestion_queue = get_ingestion_queue(astra_vector_store)
+            for uploaded_file in uploaded_files or []:
+                ingestion_queue.submit(uploaded_file.name, uploaded_file.getvalue())
+            if ingestion_queue.jobs():
+                show_ingestion_progress(ingestion_queue)
 
         with st.container(border=True):
             st.markdown("### Submit Links")
@@ -80,79 +97,52 @@ def main():
         with st.chat_message(role):
             st.markdown(content)
 
-    conversational_retrieval_chain_with_google = create_conversational_retrieval_chain(astra_vector_store,
-                                                                                       st.secrets['OPENAI_API_KEY'],
-                                                                                       st.secrets['GOOGLE_API_KEY'],
-                                                                                       st.secrets['ANTHROPIC_API_KEY'],
-                                                                                       model='Google')
-
-    # Initialize provider class
-    openai = OpenAI()
-
-    # select context to be used in feedback. the location of context is app specific.
-    from trulens_eval.app import App
-    context = App.select_context(conversational_retrieval_chain_with_google)
-
-    # Question/answer relevance between overall question and answer.
-    f_qa_relevance = Feedback(openai.relevance, name="Relevance between Q/A").on_input_output()
-
-    # Question/statement relevance between question and each context chunk.
-    f_context_relevance = (
-        Feedback(openai.context_relevance, name="Relevance between Q and Context")
-        .on_input()
-        .on(context)
-        .aggregate(np.mean)
-    )
-
-    class OpenAI_custom(fOpenAI):
-        def no_answer_feedback(self, question: str, response: str) -> float:
-            return float(self.endpoint.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system",
-                     "content": "Does the RESPONSE provide an answer to the QUESTION? Rate on a scale of 1 to 10. \
-                     Respond with the number only."},
-                    {"role": "user", "content": f"QUESTION: {question}; RESPONSE: {response}"}
-                ]
-            ).choices[0].message.content) / 10
-
-        def answer_feedback(self, question: str, response: str) -> float:
-            return float(self.endpoint.client.chat.completions.create(
-                model="gpt-4-turbo-preview",
-                messages=[
-                    {"role": "system",
-                     "content": "How factually correct is the RESPONSE to the QUESTION? Rate on a scale of 1 to 10. \
-                     Respond with the number only."},
-                    {"role": "user", "content": f"QUESTION: {question}; RESPONSE: {response}"}
-                ]
-            ).choices[0].message.content) / 10
-
-    custom = OpenAI_custom()
-
-    # No answer feedback (custom)
-    f_no_answer = Feedback(custom.no_answer_feedback, name="Accuracy between Q/A").on_input_output()
-    f_answer = Feedback(custom.no_answer_feedback, name="Groundedness").on_input_output()
-
-    google_conversational_retrieval_chain_recorder = TruChain(
-        conversational_retrieval_chain_with_google,
-        app_id="Conversation-Retrieval-Chain-feedback-Google",
-        feedbacks=[f_qa_relevance, f_context_relevance, f_no_answer, f_answer]
-    )
+    conversational_retrieval_chain_with_google = get_chain(create_conversational_retrieval_chain,
+                                                           astra_vector_store,
+                                                           st.secrets['OPENAI_API_KEY'],
+                                                           st.secrets['GOOGLE_API_KEY'],
+                                                           st.secrets['ANTHROPIC_API_KEY'],
+                                                           model='Google',
+                                                           streaming=True,
+                                                           rewrite_model=st.secrets.get('GOOGLE_REWRITE_MODEL'),
+                                                           context_tokens=st.secrets.get('CONTEXT_TOKENS'),
+                                                           reranker=st.secrets.get('RERANKER'))
+    semantic_cache = get_semantic_cache(astra_vector_store)
+    tracer = get_tracer(st.secrets.get('TRACE_PATH', '.cache/traces.jsonl'))
+    app_id = "Conversation-Retrieval-Chain-feedback-Google"
+    google_conversational_retrieval_chain_recorder = get_resource(
+        ("recorder", app_id, id(conversational_retrieval_chain_with_google)),
+        lambda: create_recorder(conversational_retrieval_chain_with_google, app_id))
+    google_feedback_worker = get_resource(
+        ("feedback_worker", id(google_conversational_retrieval_chain_recorder)),
+        lambda: FeedbackWorker(tru,
+                               google_conversational_retrieval_chain_recorder,
+                               sample_rate=st.secrets.get('FEEDBACK_SAMPLE_RATE', 1.0),
+                               tracer=tracer))
 
     if user_input := st.chat_input("Ask me anything"):
         st.session_state.google_messages.append(HumanMessage(content=user_input))
         st.chat_message("user").markdown(user_input)
         with google_conversational_retrieval_chain_recorder as recording:
-            response_data = conversational_retrieval_chain_with_google({
-                "question": user_input,
-                "chat_history": st.session_state["google_chat_history"]
-            })
+            with st.chat_message("assistant"):
+                stream_handler = StreamHandler(st.empty())
+                response_data = cached_conversational_answer(conversational_retrieval_chain_with_google,
+                                                             semantic_cache,
+                                                             'Google',
+                                                             user_input,
+                                                             st.session_state["google_chat_history"].messages(),
+                                                             callbacks=[stream_handler, tracer],
+                                                             router=get_intent_router(astra_vector_store.embeddings))
+                stream_handler.container.markdown(response_data["answer"])
             print(response_data)
-            st.session_state["google_chat_history"].append((user_input, response_data["answer"]))
-            st.chat_message("assistant").markdown(response_data["answer"])
+            st.session_state["google_chat_history"].add_turn(user_input, response_data["answer"])
             st.session_state.google_messages.append(AIMessage(content=response_data["answer"]))
             if len(st.session_state.google_messages) > 25:
                 st.session_state.google_messages = st.session_state.google_messages[-25:]
+        # Answers served from the semantic cache never ran the chain, so there is nothing to evaluate. A follow-up
+        # question may also leave a record for the condensing step; the chain's own record is the last one.
+        if not response_data["cached"]:
+            google_feedback_worker.submit(recording.records[-1])
 
 
 if __name__ == "__main__":
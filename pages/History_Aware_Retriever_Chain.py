@@ -3,9 +3,14 @@ from langchain.schema import HumanMessage, SystemMessage, AIMessage
 from langchain_community.callbacks.manager import get_openai_callback
 from langchain_community.callbacks.openai_info import OpenAICallbackHandler
 
-from utils.data_loader import populate_vector_store, scrape_link
-from utils.initialize_vector_store import initialize_vector_store
+from utils.data_loader import scrape_link
+from utils.ingestion_jobs import get_ingestion_queue, show_ingestion_progress
+from utils.registry import get_chain, get_vector_store
 from utils.create_chains import create_history_aware_retriever_chain
+from utils.rewrite_gate import rewrite_stats
+from utils.chat_history import create_history_manager
+from utils.intent_router import get_intent_router, router_stats
+from utils.tracing import get_tracer, show_stage_latencies
 
 
 def update_usage(cb: OpenAICallbackHandler) -> None:
@@ -24,6 +29,10 @@ def update_usage(cb: OpenAICallbackHandler) -> None:
 def main():
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "history" not in st.session_state:
+        st.session_state.history = create_history_manager(st.secrets.get('OPENAI_API_KEY'),
+                                                          st.secrets.get('SUMMARY_MODEL', 'gpt-3.5-turbo'),
+                                                          max_tokens=st.secrets.get('HISTORY_TOKENS', 1500))
     if "usage" not in st.session_state:
         st.session_state.usage = {
             "total_tokens": 0,
@@ -32,7 +41,8 @@ def main():
             "total_cost": 0.0,
         }
 
-    astra_vector_store = initialize_vector_store(st.secrets['ASTRA_DB_APPLICATION_TOKEN'], st.secrets['ASTRA_DB_ID'])
+    astra_vector_store = get_vector_store(st.secrets.get('ASTRA_DB_APPLICATION_TOKEN'), st.secrets.get('ASTRA_DB_ID'),
+                                          backend=st.secrets.get('VECTOR_STORE_BACKEND', 'astra'))
 
     st.set_page_config(page_title="Healthcare Chatbot", page_icon=":robot_face:")
     st.header('History Aware Retriever Healthcare Chatbot')
@@ -41,6 +51,14 @@ def main():
         if st.session_state["usage"]:
             st.metric("Total Tokens", st.session_state["usage"]["total_tokens"])
             st.metric("Total Costs in $", round(st.session_state["usage"]["total_cost"], 2))
+        embedding_cache = astra_vector_store.embeddings.stats()
+        st.metric("Embedding Cache Hits", embedding_cache["hits"], help=f"{embedding_cache['misses']} misses")
+        st.metric("Rewrites Skipped", rewrite_stats.skipped,
+                  help=f"{rewrite_stats.rewritten} rewritten, about {rewrite_stats.saved_seconds:.1f}s saved")
+        st.metric("History Tokens", st.session_state.history.token_count(),
+                  help="Last turns verbatim, older turns summarized")
+        st.metric("Answered Locally", f"{router_stats.handled_fraction:.0%}", help=str(router_stats))
+        show_stage_latencies()
         st.header("Upload Section")
         with st.container(border=True):
             st.markdown("### Upload Files")
@@ -48,10 +66,12 @@ def main():
                                               accept_multiple_files=True,
                                               type=['csv', 'pdf', 'json', 'html', 'md'],
                                               label_visibility='hidden')
-            if uploaded_files:
-                for uploaded_file in uploaded_files:
-                    populate_vector_store(uploaded_file, astra_vector_store)
-                    st.success(f"Processed file {uploaded_file.name}. You may ask me questions about the file now.")
+            # Ingested in the background; rerunning with the same uploads does not submit them again.
+            ingestion_queue = get_ingestion_queue(astra_vector_store)
+            for uploaded_file in uploaded_files or []:
+                ingestion_queue.submit(uploaded_file.name, uploaded_file.getvalue())
+            if ingestion_queue.jobs():
+                show_ingestion_progress(ingestion_queue)
 
         with st.container(border=True):
             st.markdown("### Submit Links")
@@ -83,16 +103,30 @@ def main():
 
         with st.chat_message(role):
             st.markdown(content)
-    retriever_chain = create_history_aware_retriever_chain(astra_vector_store,
-                                                           st.secrets['OPENAI_API_KEY'])
+    retriever_chain = get_chain(create_history_aware_retriever_chain,
+                                astra_vector_store,
+                                st.secrets['OPENAI_API_KEY'],
+                                rewrite_model=st.secrets.get('OPENAI_REWRITE_MODEL'),
+                                context_tokens=st.secrets.get('CONTEXT_TOKENS'),
+                                reranker=st.secrets.get('RERANKER'))
+    intent_router = get_intent_router(astra_vector_store.embeddings)
+    tracer = get_tracer(st.secrets.get('TRACE_PATH', '.cache/traces.jsonl'))
     if user_input := st.chat_input("Ask me anything"):
         st.session_state.messages.append(HumanMessage(content=user_input))
         st.chat_message("user").markdown(user_input)
-        with get_openai_callback() as cb:
-            response = retriever_chain.invoke({"input": user_input, "chat_history": st.session_state.messages})
-            update_usage(cb)
+        with tracer.span("intent_router"):
+            routed = intent_router.route(user_input, st.session_state.history.messages())
+        if routed:
+            response = {"answer": routed[1]}
+        else:
+            with get_openai_callback() as cb:
+                response = retriever_chain.invoke({"input": user_input,
+                                                   "chat_history": st.session_state.history.messages()},
+                                                  config={"callbacks": [tracer]})
+                update_usage(cb)
         st.chat_message("assistant").markdown(response['answer'])
         st.session_state.messages.append(AIMessage(content=response['answer']))
+        st.session_state.history.add_turn(user_input, response['answer'])
         if len(st.session_state.messages) > 25:
             st.session_state.messages = st.session_state.messages[-25:]
 
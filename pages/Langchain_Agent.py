@@ -1,31 +1,32 @@
 import streamlit as st
 from langchain.schema import HumanMessage, SystemMessage, AIMessage
-from langchain.callbacks.base import BaseCallbackHandler
 
-from utils.data_loader import populate_vector_store, scrape_link
-from utils.initialize_vector_store import initialize_vector_store
+from utils.data_loader import scrape_link
+from utils.ingestion_jobs import get_ingestion_queue, show_ingestion_progress
+from utils.registry import get_chain, get_vector_store
 from utils.create_chains import create_agent_executor
-
-
-class StreamHandler(BaseCallbackHandler):
-    def __init__(self, container, initial_text=""):
-        self.container = container
-        self.text = initial_text
-
-    def on_llm_new_token(self, token: str, **kwargs) -> None:
-        self.text += token
-        self.container.markdown(self.text)
+from utils.streaming import StreamHandler
+from utils.chat_history import create_history_manager
+from utils.intent_router import get_intent_router, router_stats
+from utils.tracing import get_tracer, show_stage_latencies
 
 
 def main():
     if "agent_messages" not in st.session_state:
         st.session_state.agent_messages = []
+    if "agent_history" not in st.session_state:
+        st.session_state.agent_history = create_history_manager(st.secrets.get('OPENAI_API_KEY'),
+                                                                st.secrets.get('SUMMARY_MODEL', 'gpt-3.5-turbo'),
+                                                                max_tokens=st.secrets.get('HISTORY_TOKENS', 1500))
 
-    astra_vector_store = initialize_vector_store(st.secrets['ASTRA_DB_APPLICATION_TOKEN'], st.secrets['ASTRA_DB_ID'])
+    astra_vector_store = get_vector_store(st.secrets.get('ASTRA_DB_APPLICATION_TOKEN'), st.secrets.get('ASTRA_DB_ID'),
+                                          backend=st.secrets.get('VECTOR_STORE_BACKEND', 'astra'))
 
     st.set_page_config(page_title="Healthcare Chatbot", page_icon=":robot_face:")
     st.header('Agent Healthcare Chatbot')
     with st.sidebar:
+        st.metric("Answered Locally", f"{router_stats.handled_fraction:.0%}", help=str(router_stats))
+        show_stage_latencies()
         st.header("Upload Section")
         with st.container(border=True):
             st.markdown("### Upload Files")
@@ -33,10 +34,12 @@ def main():
                                               accept_multiple_files=True,
                                               type=['csv', 'pdf', 'json', 'html', 'md'],
                                               label_visibility='hidden')
-            if uploaded_files:
-                for uploaded_file in uploaded_files:
-                    populate_vector_store(uploaded_file, astra_vector_store)
-                    st.success(f"Processed file {uploaded_file.name}. You may ask me questions about the file now.")
+            # Ingested in the background; rerunning with the same uploads does not submit them again.
+            ingestion_queue = get_ingestion_queue(astra_vector_store)
+            for uploaded_file in uploaded_files or []:
+                ingestion_queue.submit(uploaded_file.name, uploaded_file.getvalue())
+            if ingestion_queue.jobs():
+                show_ingestion_progress(ingestion_queue)
 
         with st.container(border=True):
             st.markdown("### Submit Links")
@@ -69,14 +72,25 @@ def main():
         with st.chat_message(role):
             st.markdown(content)
 
+    agent_executor = get_chain(create_agent_executor, astra_vector_store, st.secrets['OPENAI_API_KEY'])
+    intent_router = get_intent_router(astra_vector_store.embeddings)
+    tracer = get_tracer(st.secrets.get('TRACE_PATH', '.cache/traces.jsonl'))
     if user_input := st.chat_input("Ask me anything"):
         st.session_state.agent_messages.append(HumanMessage(content=user_input))
         st.chat_message("user").markdown(user_input)
+        with tracer.span("intent_router"):
+            routed = intent_router.route(user_input, st.session_state.agent_history.messages())
         with st.chat_message("assistant"):
-            stream_handler = StreamHandler(st.empty())
-            agent_executor = create_agent_executor(astra_vector_store, st.secrets['OPENAI_API_KEY'], stream_handler)
-            response = agent_executor.invoke({"input": user_input, "chat_history": st.session_state.agent_messages})
+            if routed:
+                st.markdown(routed[1])
+                response = {"output": routed[1]}
+            else:
+                stream_handler = StreamHandler(st.empty())
+                response = agent_executor.invoke({"input": user_input,
+                                                  "chat_history": st.session_state.agent_history.messages()},
+                                                 config={"callbacks": [stream_handler, tracer]})
         st.session_state.agent_messages.append(AIMessage(content=response['output']))
+        st.session_state.agent_history.add_turn(user_input, response['output'])
         if len(st.session_state.agent_messages) > 25:
             st.session_state.agent_messages = st.session_state.agent_messages[-25:]
 
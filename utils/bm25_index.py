@@ -0,0 +1,203 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document
+
+from utils.registry import get_resource
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+_PARTS = re.compile(r"[.\-/]")
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can do does for from had has have how i if in into is it its me my no not of "
+    "on or so than that the their then there these they this to was were what when where which who why will with "
+    "you your".split())
+
+
+def tokenize(text):
+    tokens = [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+    # Compound terms (ICD codes such as e11.9, names such as covid-19) are also indexed by their parts, so a query
+    # for "E11" or "covid" still matches them.
+    for token in [token for token in tokens if not token.isalnum()]:
+        tokens.extend(part for part in _PARTS.split(token) if part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    # Keyword side of the hybrid retriever. Chunks are kept in a SQLite table next to the other caches, written by
+    # the same ingestion paths that write the vector store, and the inverted index (term -> numpy arrays of rows and
+    # term frequencies) is built in memory from it. Every write is also appended to a change log, so a running app
+    # applies chunks loaded by another process (the bulk loader) on its next query without rebuilding the index.
+    # Each rebuild truncates the log up to the snapshot it loaded; an index that was further behind than that rebuilds
+    # too.
+    def __init__(self, path=".cache/bm25.sqlite3", k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, text TEXT NOT NULL, metadata TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS log (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT NOT NULL)")
+        self._load()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _last_seq(self):
+        return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM log").fetchone()[0]
+
+    def _load(self):
+        self._ids = []
+        self._rows = {}
+        self._lengths = []
+        self._dead = set()
+        self._postings = {}
+        self._arrays = {}
+        self._length_array = None
+        self._dead_mask = None
+        self._total_length = 0
+        # One read transaction, so the log position matches the snapshot of the docs table.
+        self._conn.execute("BEGIN")
+        try:
+            self._seq = self._last_seq()
+            for row_id, text in self._conn.execute("SELECT id, text FROM docs"):
+                self._index(row_id, text)
+        finally:
+            self._conn.execute("COMMIT")
+        # Every change up to the snapshot is in the docs table; the last entry stays to mark where the log starts.
+        self._conn.execute("DELETE FROM log WHERE seq < ?", (self._seq,))
+
+    def _refresh(self):
+        first = self._conn.execute("SELECT MIN(seq) FROM log").fetchone()[0]
+        if first is not None and first > self._seq + 1:
+            # Another process truncated changes this index has not applied yet.
+            self._load()
+            return
+        changes = self._conn.execute("SELECT seq, id FROM log WHERE seq > ? ORDER BY seq", (self._seq,)).fetchall()
+        if not changes:
+            return
+        self._seq = changes[-1][0]
+        changed = list(dict.fromkeys(row_id for _, row_id in changes))
+        # The table holds the latest state of every changed chunk: present means added or replaced, absent deleted.
+        for start in range(0, len(changed), 500):
+            batch = changed[start:start + 500]
+            texts = dict(self._conn.execute(f"SELECT id, text FROM docs WHERE id IN ({','.join('?' * len(batch))})",
+                                            batch).fetchall())
+            for row_id in batch:
+                if row_id in texts:
+                    self._index(row_id, texts[row_id])
+                elif row_id in self._rows:
+                    self._remove(row_id)
+        # Deleted and replaced rows stay in the postings, masked out of scores and document frequencies, until the
+        # next rebuild.
+        if len(self._dead) > max(len(self._rows), 1024):
+            self._load()
+
+    def _index(self, row_id, text):
+        if row_id in self._rows:
+            self._remove(row_id)
+        row = len(self._ids)
+        tokens = tokenize(text)
+        postings, arrays = self._postings, self._arrays
+        for term, tf in Counter(tokens).items():
+            if term in postings:
+                postings[term][0].append(row)
+                postings[term][1].append(tf)
+                if term in arrays:
+                    del arrays[term]
+            else:
+                postings[term] = ([row], [tf])
+        self._ids.append(row_id)
+        self._rows[row_id] = row
+        self._lengths.append(len(tokens))
+        self._total_length += len(tokens)
+        self._length_array = None
+        self._dead_mask = None
+
+    def _remove(self, row_id):
+        row = self._rows.pop(row_id)
+        self._dead.add(row)
+        self._dead_mask = None
+        self._total_length -= self._lengths[row]
+
+    def _write(self, statement, rows, ids):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(statement, rows)
+                self._conn.executemany("INSERT INTO log (id) VALUES (?)", [(row_id,) for row_id in ids])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._refresh()
+
+    def add(self, ids, texts, metadatas=None):
+        ids = list(ids)
+        metadatas = metadatas or [{} for _ in texts]
+        rows = [(row_id, text, json.dumps(metadata or {})) for row_id, text, metadata in zip(ids, texts, metadatas)]
+        self._write("INSERT OR REPLACE INTO docs (id, text, metadata) VALUES (?, ?, ?)", rows, ids)
+
+    def delete(self, ids):
+        ids = list(ids)
+        self._write("DELETE FROM docs WHERE id = ?", [(row_id,) for row_id in ids], ids)
+
+    def _term_arrays(self, term):
+        if term not in self._arrays:
+            rows, tfs = self._postings[term]
+            self._arrays[term] = (np.asarray(rows, dtype=np.int64), np.asarray(tfs, dtype=np.float32))
+        return self._arrays[term]
+
+    def search_ids(self, query, k=4):
+        with self._lock:
+            self._refresh()
+            if not self._rows:
+                return []
+            if self._length_array is None:
+                self._length_array = np.asarray(self._lengths, dtype=np.float32)
+            if self._dead and self._dead_mask is None:
+                self._dead_mask = np.zeros(len(self._ids), dtype=bool)
+                self._dead_mask[np.fromiter(self._dead, dtype=np.int64, count=len(self._dead))] = True
+            n = len(self._rows)
+            average_length = self._total_length / n or 1.0
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for term in set(tokenize(query)):
+                if term not in self._postings:
+                    continue
+                rows, tfs = self._term_arrays(term)
+                if self._dead:
+                    live = ~self._dead_mask[rows]
+                    rows, tfs = rows[live], tfs[live]
+                    if not len(rows):
+                        continue
+                df = len(rows)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                norm = self.k1 * (1 - self.b + self.b * self._length_array[rows] / average_length)
+                scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k)[:k]]
+            matched = matched[np.argsort(-scores[matched])]
+            return [(self._ids[row], float(scores[row])) for row in matched]
+
+    def search(self, query, k=4):
+        hits = self.search_ids(query, k)
+        if not hits:
+            return []
+        with self._lock:
+            rows = dict((row_id, (text, metadata)) for row_id, text, metadata in self._conn.execute(
+                f"SELECT id, text, metadata FROM docs WHERE id IN ({','.join('?' * len(hits))})",
+                [row_id for row_id, _ in hits]))
+        return [(Document(page_content=rows[row_id][0], metadata=json.loads(rows[row_id][1] or "{}")), score)
+                for row_id, score in hits if row_id in rows]
+
+
+def get_keyword_index(path=".cache/bm25.sqlite3"):
+    return get_resource(("keyword_index", path), lambda: BM25Index(path))
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.manifest import chunk_id, file_hash
+
+# Three stage pipeline: files are parsed in a process pool, documents are embedded in fixed-size batches with a
+# bounded number of requests in flight, and embedded batches are written to the store by a dedicated thread.
+# Stages are connected by bounded queues, so a slow store (or a slow embeddings API) throttles parsing instead of
+# letting documents pile up in memory.
+_DONE = object()
+
+
+class IngestStats:
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.parsed = 0
+        self.embedded = 0
+        self.written = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def docs_per_second(self):
+        return self.written / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.files} files ({self.skipped} unchanged), {self.parsed} parsed, {self.embedded} embedded, "
+                f"{self.written} written in {self.elapsed:.1f}s "
+                f"({self.docs_per_second:.1f} docs/sec, {len(self.errors)} errors)")
+
+
+def _parse_stage(file_paths, parse_file, parse_workers, documents, stats, manifest, plans, full):
+    workers = parse_workers or os.cpu_count() or 1
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+
+            def drain_one():
+                path, digest, future = pending.popleft()
+                try:
+                    records = future.result()
+                except Exception as e:
+                    stats.errors.append((path, e))
+                    return
+                stats.files += 1
+                existing = manifest.chunk_ids(path) if manifest else set()
+                seen = set()
+                for text, metadata in records:
+                    cid = chunk_id(path, text)
+                    stats.parsed += 1
+                    if cid not in seen and (full or cid not in existing):
+                        documents.put((text, metadata, cid))
+                    seen.add(cid)
+                plans.append((path, digest, seen, existing - seen))
+
+            # Only a small window of files is parsed ahead of the embedding stage.
+            for path in file_paths:
+                digest = file_hash(path) if manifest else None
+                if manifest and not full and manifest.is_unchanged(path, digest):
+                    stats.skipped += 1
+                    continue
+                pending.append((path, digest, pool.submit(parse_file, path)))
+                if len(pending) >= workers * 2:
+                    drain_one()
+            while pending:
+                drain_one()
+    except Exception as e:
+        # The pool itself failed (a worker crashed, parse_file could not be pickled): the files not drained yet have
+        # no plan and are retried by the next run.
+        stats.errors.append(("parse", e))
+    finally:
+        documents.put(_DONE)
+
+
+def _write_stage(write_batch, keyword_index, embedded, stats, progress):
+    while True:
+        item = embedded.get()
+        if item is _DONE:
+            return
+        texts, vectors, metadatas, ids = item
+        try:
+            write_batch(texts, vectors, metadatas, ids)
+            if keyword_index is not None:
+                keyword_index.add(ids, texts, metadatas)
+            stats.written += len(texts)
+        except Exception as e:
+            stats.errors.append(("write", e))
+        if progress:
+            progress(stats)
+
+
+def run_bulk_ingest(file_paths,
+                    parse_file,
+                    embedder,
+                    astra_vector_store,
+                    batch_size=64,
+                    max_in_flight=4,
+                    parse_workers=None,
+                    queue_size=2048,
+                    write_batch=None,
+                    delete_ids=None,
+                    manifest=None,
+                    keyword_index=None,
+                    full=False,
+                    progress=None):
+    # parse_file(path) -> [(text, metadata), ...] must be a module-level function so it can run in a worker
+    # process. embedder only needs embed_documents and the store only needs to be accepted by write_batch, which
+    # makes the pipeline easy to drive with a fake embedder and an in-memory store.
+    # With a manifest, unchanged files are skipped before parsing and only new chunks of changed files are embedded;
+    # chunks that disappeared are deleted once the run has finished without errors. With full, every file and chunk
+    # is parsed and embedded again and the manifest is rewritten from the result. With a keyword_index, written
+    # chunks are also added to (and removed chunks deleted from) the BM25 index of the hybrid retriever.
+    if write_batch is None:
+        from utils.initialize_vector_store import add_embeddings
+
+        def write_batch(texts, vectors, metadatas, ids):
+            add_embeddings(astra_vector_store, texts, vectors, metadatas, ids)
+    if delete_ids is None and astra_vector_store is not None:
+        delete_ids = astra_vector_store.delete
+
+    stats = IngestStats()
+    plans = []
+    documents = queue.Queue(maxsize=queue_size)
+    embedded = queue.Queue(maxsize=max_in_flight)
+
+    parser = threading.Thread(target=_parse_stage,
+                              args=(file_paths, parse_file, parse_workers, documents, stats, manifest, plans, full),
+                              daemon=True)
+    writer = threading.Thread(target=_write_stage,
+                              args=(write_batch, keyword_index, embedded, stats, progress),
+                              daemon=True)
+    parser.start()
+    writer.start()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as embed_pool:
+        in_flight = deque()
+
+        def hand_off_oldest():
+            texts, metadatas, ids, future = in_flight.popleft()
+            try:
+                vectors = future.result()
+            except Exception as e:
+                stats.errors.append(("embed", e))
+                return
+            stats.embedded += len(texts)
+            # Blocks while the writer is behind, which in turn stops new embedding requests.
+            embedded.put((texts, vectors, metadatas, ids))
+
+        def submit(batch):
+            texts = [text for text, _, _ in batch]
+            metadatas = [metadata for _, metadata, _ in batch]
+            ids = [cid for _, _, cid in batch]
+            in_flight.append((texts, metadatas, ids, embed_pool.submit(embedder.embed_documents, texts)))
+            # Batches are handed to the writer in submission order.
+            while in_flight and (in_flight[0][3].done() or len(in_flight) >= max_in_flight):
+                hand_off_oldest()
+
+        batch = []
+        while True:
+            item = documents.get()
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
+        while in_flight:
+            hand_off_oldest()
+
+    embedded.put(_DONE)
+    writer.join()
+    parser.join()
+
+    # Files that failed to parse have no plan; a failed embed or write batch leaves the whole run unrecorded so the
+    # next run retries it.
+    if manifest and not any(stage in ("embed", "write") for stage, _ in stats.errors):
+        for source, digest, seen, removed in plans:
+            if removed and delete_ids:
+                delete_ids(list(removed))
+            if removed and keyword_index is not None:
+                keyword_index.delete(removed)
+            manifest.record(source, digest, seen)
+    stats.finished = time.perf_counter()
+    return stats
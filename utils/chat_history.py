@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+
+from utils.context_packer import count_tokens
+from utils.llm_factory import get_chat_llm
+
+# Folding old turns into the summary is an extra LLM call; it runs here, after the answer has been shown, so it
+# never adds to the latency of a turn.
+_summarizer_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+
+class HistoryManager:
+    # Chat history handed to the chains. The last max_turns (question, answer) pairs are kept verbatim; older turns
+    # are folded into a running summary that is updated incrementally (current summary + the evicted turns), so the
+    # history sent with each request stays under max_tokens however long the conversation gets. Turns that have been
+    # evicted but not folded in yet are still sent verbatim, as long as they fit.
+    def __init__(self, summarizer=None, max_turns=4, max_tokens=1500, summary_tokens=400,
+                 model_name="gpt-4-turbo-preview"):
+        self.summarizer = summarizer
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.model_name = model_name
+        self.summary = ""
+        self.turns = []
+        self._pending = []
+        self._folding = None
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        return count_tokens(text, self.model_name)
+
+    def _turn_tokens(self, turns):
+        return sum(self.count(question) + self.count(answer) for question, answer in turns)
+
+    def add_turn(self, question, answer):
+        with self._lock:
+            self.turns.append((question, answer))
+            # The latest turn always stays, even on its own over the budget: a follow-up most likely refers to it.
+            while len(self.turns) > 1 and (len(self.turns) > self.max_turns or
+                                           self._turn_tokens(self.turns) > self.max_tokens - self.summary_tokens):
+                self._pending.append(self.turns.pop(0))
+        self._schedule_fold()
+
+    def _schedule_fold(self):
+        with self._lock:
+            if self._pending and (self._folding is None or self._folding.done()):
+                self._folding = _summarizer_pool.submit(self._fold)
+
+    def _summarize(self, summary, turns):
+        if self.summarizer is None:
+            # Without a model, remember what was asked; the answers are the bulk of the tokens.
+            return "\n".join(filter(None, [summary] + [f"The user asked: {question}" for question, _ in turns]))
+        new_lines = "\n".join(f"Human: {question}\nAI: {answer}" for question, answer in turns)
+        chain = SUMMARY_PROMPT | self.summarizer | StrOutputParser()
+        return chain.invoke({"summary": summary, "new_lines": new_lines}).strip()
+
+    def _clip(self, text, limit):
+        # Drops the oldest part of the summary until it fits.
+        words = text.split(" ")
+        while len(words) > 1 and self.count(" ".join(words)) > limit:
+            words = words[max(len(words) // 10, 1):]
+        return " ".join(words)
+
+    def _fold(self):
+        with self._lock:
+            batch, summary = list(self._pending), self.summary
+        try:
+            updated = self._clip(self._summarize(summary, batch), self.summary_tokens)
+        except Exception as e:
+            # The turns stay pending and are retried with the next eviction.
+            print(f"History summary failed: {e}")
+            return
+        with self._lock:
+            self.summary = updated
+            del self._pending[:len(batch)]
+            if self._pending:
+                self._folding = _summarizer_pool.submit(self._fold)
+
+    def wait(self, timeout=None):
+        folding = self._folding
+        if folding is not None:
+            folding.result(timeout)
+
+    def _selected(self):
+        with self._lock:
+            summary, pending, turns = self.summary, list(self._pending), list(self.turns)
+        budget = self.max_tokens - (self.count(summary) if summary else 0) - self._turn_tokens(turns)
+        while pending and self._turn_tokens(pending) > budget:
+            pending.pop(0)
+        return summary, pending + turns
+
+    def messages(self):
+        summary, turns = self._selected()
+        messages = [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] if summary else []
+        for question, answer in turns:
+            messages.extend([HumanMessage(content=question), AIMessage(content=answer)])
+        return messages
+
+    def token_count(self):
+        return sum(self.count(message.content) for message in self.messages())
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.turns = []
+            self._pending = []
+
+
+def create_history_manager(openai_api_key=None, summary_model="gpt-3.5-turbo", **kwargs):
+    summarizer = get_chat_llm('OpenAI', openai_api_key, temperature=0, model_name=summary_model) \
+        if openai_api_key else None
+    return HistoryManager(summarizer, **kwargs)
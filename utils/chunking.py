@@ -0,0 +1,102 @@
+import re
+from bisect import bisect_left, bisect_right
+
+from utils.context_packer import token_encoding
+from utils.registry import get_resource
+
+# Split points, coarsest first: paragraph break, line break, end of sentence, between words. Every paragraph break
+# is a line break as well.
+SEPARATORS = [re.compile(r"\n[ \t]*\n"), re.compile(r"\n"), re.compile(r"(?<=[.!?])[ \t]+"), re.compile(r"[ \t]+")]
+
+
+class TextChunker:
+    # Linear-time replacement for RecursiveCharacterTextSplitter(chunk_size, chunk_overlap). Split points are found
+    # once per text; each chunk then ends at the last split point of the coarsest level that fits in chunk_size (a
+    # hard cut only if no split point fits). As in the splitter, the next chunk carries over the whole trailing units
+    # of that level (paragraphs, lines, sentences or words) that fit in chunk_overlap, and none if the last unit is
+    # longer than that. With mode="tokens", sizes are counted in tokens of model_name from a single encoding of the
+    # whole text (4 characters per token if tiktoken has no vocabulary).
+    def __init__(self, chunk_size=800, chunk_overlap=200, mode="chars", model_name="gpt-4-turbo-preview"):
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        if mode not in ("chars", "tokens"):
+            raise ValueError(f"Unknown chunking mode: {mode}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.mode = mode
+        self.model_name = model_name
+
+    def _measure(self, text):
+        # Returns limit(start) -> furthest end, and back(end) -> where the overlap of a chunk ending there begins.
+        if self.mode == "chars":
+            return lambda start: start + self.chunk_size, lambda end: end - self.chunk_overlap
+        encoding = token_encoding(self.model_name)
+        if encoding is None:
+            return lambda start: start + 4 * self.chunk_size, lambda end: end - 4 * self.chunk_overlap
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        offsets.append(len(text))
+
+        def limit(start):
+            return offsets[min(bisect_right(offsets, start) - 1 + self.chunk_size, len(offsets) - 1)]
+
+        def back(end):
+            return offsets[max(bisect_left(offsets, end) - self.chunk_overlap, 0)]
+
+        return limit, back
+
+    def spans(self, text):
+        # (start, end) character offsets of the chunks, whitespace trimmed.
+        levels = [[match.start() for match in separator.finditer(text)] for separator in SEPARATORS]
+        limit, back = self._measure(text)
+
+        spans = []
+        n = len(text)
+        start = floor = 0
+        while True:
+            while start < n and text[start].isspace():
+                start += 1
+            if start >= n:
+                return spans
+            end = limit(start)
+            units = None
+            if end >= n:
+                end = n
+            else:
+                for positions in levels:
+                    i = bisect_right(positions, end) - 1
+                    if i >= 0 and positions[i] > max(start, floor):
+                        end = positions[i]
+                        units = positions
+                        break
+            trimmed = end
+            while trimmed > start and text[trimmed - 1].isspace():
+                trimmed -= 1
+            spans.append((start, trimmed))
+            if end >= n:
+                return spans
+            # Every chunk must take in text past the end of the previous one, so an overlap never produces the same
+            # short chunk twice.
+            floor = end
+            while floor < n and text[floor].isspace():
+                floor += 1
+            next_start = end
+            if self.chunk_overlap and units is not None:
+                # The earliest split point of the same level inside the overlap starts the next chunk.
+                i = bisect_left(units, max(back(end), start + 1))
+                if i < len(units) and units[i] < end:
+                    next_start = units[i]
+            start = next_start
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.spans(text)]
+
+    def split(self, text, metadata):
+        # (chunk, metadata) pairs. offset is the chunk's character offset in text; everything in metadata (source,
+        # page, row, ...) is carried over to every chunk.
+        for index, (start, end) in enumerate(self.spans(text)):
+            yield text[start:end], {**metadata, "offset": start, "chunk": index}
+
+
+def get_chunker(chunk_size=800, chunk_overlap=200, mode="chars"):
+    return get_resource(("chunker", chunk_size, chunk_overlap, mode),
+                        lambda: TextChunker(chunk_size, chunk_overlap, mode))
@@ -0,0 +1,123 @@
+import functools
+import re
+
+from langchain_core.documents import Document
+
+from utils.bm25_index import tokenize
+
+# Retrieved context per chat model, in tokens. The answer prompt and the chat history come on top of this, so the
+# budget bounds the cost and latency added by retrieval rather than the full request.
+CONTEXT_TOKEN_BUDGETS = {
+    'OpenAI': 3000,
+    'Google': 3000,
+    'Claude': 3000,
+}
+DEFAULT_CONTEXT_TOKENS = 2000
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"\w+")
+
+
+@functools.lru_cache(maxsize=None)
+def token_encoding(model_name):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Not an OpenAI model; cl100k is close enough for budgeting.
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # tiktoken is missing or could not fetch its vocabulary; fall back to an estimate.
+        return None
+
+
+@functools.lru_cache(maxsize=16384)
+def count_tokens(text, model_name="gpt-4-turbo-preview"):
+    encoding = token_encoding(model_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _shingles(text, size=5):
+    words = _WORD.findall(text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+class ContextPacker:
+    # Fits retrieved chunks into a fixed token budget. Chunks arrive best first; near-duplicates of an earlier chunk
+    # (Jaccard similarity of word 5-grams above duplicate_threshold, e.g. the same passage scraped from two pages)
+    # are dropped, each chunk is capped at chunk_tokens, and a chunk over its share of the budget is reduced to the
+    # sentences that share the most terms with the query, kept in their original order. Text in which no sentence
+    # fits (tables, lists, JSON records) is cut at the limit instead.
+    def __init__(self, token_budget=DEFAULT_CONTEXT_TOKENS, model_name="gpt-4-turbo-preview", chunk_tokens=600,
+                 duplicate_threshold=0.8):
+        self.token_budget = token_budget
+        self.model_name = model_name
+        self.chunk_tokens = chunk_tokens
+        self.duplicate_threshold = duplicate_threshold
+
+    def count(self, text):
+        return count_tokens(text, self.model_name)
+
+    def _is_duplicate(self, shingles, kept):
+        for other in kept:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.duplicate_threshold:
+                return True
+        return False
+
+    def truncate(self, text, limit):
+        encoding = token_encoding(self.model_name)
+        if encoding is None:
+            return text[:4 * limit].rstrip()
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:limit]).rstrip()
+
+    def compress(self, query, text, budget):
+        sentences = [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+        terms = set(tokenize(query))
+        ranked = sorted(range(len(sentences)),
+                        key=lambda i: (-len(terms.intersection(tokenize(sentences[i]))), i))
+        selected, used = [], 0
+        for i in ranked:
+            tokens = self.count(sentences[i])
+            if used + tokens <= budget:
+                selected.append(i)
+                used += tokens
+        if not selected:
+            return self.truncate(text, budget)
+        return " ".join(sentences[i].strip() for i in sorted(selected))
+
+    def pack(self, query, documents):
+        unique, kept = [], []
+        for doc in documents:
+            shingles = _shingles(doc.page_content)
+            if not self._is_duplicate(shingles, kept):
+                kept.append(shingles)
+                unique.append((doc, self.count(doc.page_content)))
+
+        # When everything fits, chunks only need capping. Otherwise every remaining chunk gets an equal share of what
+        # is left, so the top chunks cannot crowd out a relevant passage further down; space a chunk does not use
+        # passes on to the next ones.
+        fits = sum(min(tokens, self.chunk_tokens) for _, tokens in unique) <= self.token_budget
+        packed, used = [], 0
+        for position, (doc, tokens) in enumerate(unique):
+            remaining = self.token_budget - used
+            if remaining <= 0:
+                break
+            limit = min(self.chunk_tokens, remaining if fits else remaining // (len(unique) - position))
+            text = doc.page_content
+            if tokens > limit:
+                text = self.compress(query, text, limit)
+                if not text:
+                    continue
+                tokens = self.count(text)
+            packed.append(Document(page_content=text,
+                                   metadata={**doc.metadata, "tokens": tokens, "compressed": text != doc.page_content}))
+            used += tokens
+        return packed
+
+
+def context_packer_for(provider, token_budget=None, model_name="gpt-4-turbo-preview"):
+    return ContextPacker(token_budget or CONTEXT_TOKEN_BUDGETS.get(provider, DEFAULT_CONTEXT_TOKENS), model_name)
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.registry import get_resource
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/89.0.4389.82 Safari/537.36')
+
+
+class FetchResult:
+    def __init__(self, url, status=None, html=None, etag=None, last_modified=None, error=None):
+        self.url = url
+        self.status = status
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.error = error
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+    @property
+    def ok(self):
+        return self.status == 200 and self.html is not None
+
+    def __str__(self):
+        if self.error:
+            return f"{self.url}: failed ({self.error})"
+        if self.not_modified:
+            return f"{self.url}: not modified"
+        return f"{self.url}: {self.status}"
+
+
+class Validators:
+    # ETag / Last-Modified per URL from the last successful ingestion, sent back as If-None-Match /
+    # If-Modified-Since so that unchanged pages answer 304 without a body.
+    def __init__(self, path=".cache/crawl.sqlite3"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS validators ("
+                           "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified FROM validators WHERE url = ?", (url,)).fetchone()
+        return row or (None, None)
+
+    def remember(self, result):
+        if not (result.etag or result.last_modified):
+            return
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?)",
+                               (result.url, result.etag, result.last_modified, time.time()))
+
+    def forget(self, url):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM validators WHERE url = ?", (url,))
+
+
+class Crawler:
+    # Fetches many URLs concurrently over one pooled aiohttp session. Politeness is per host: at most per_host
+    # requests in flight and at least host_interval seconds between request starts to the same host; requests to
+    # different hosts never wait for each other. Each page is downloaded once and its body returned for parsing.
+    def __init__(self, concurrency=16, per_host=2, host_interval=1.0, timeout=10, validators=None,
+                 user_agent=USER_AGENT):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_interval = host_interval
+        self.timeout = timeout
+        self.validators = validators
+        self.user_agent = user_agent
+
+    async def _wait_turn(self, host, locks, last_start):
+        async with locks[host]:
+            delay = last_start[host] + self.host_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            last_start[host] = time.monotonic()
+
+    async def _fetch(self, session, url, locks, last_start):
+        headers = {}
+        if self.validators is not None:
+            etag, last_modified = self.validators.get(url)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        try:
+            await self._wait_turn(urlsplit(url).netloc, locks, last_start)
+            async with session.get(url, headers=headers) as response:
+                result = FetchResult(url, response.status, etag=response.headers.get('ETag'),
+                                     last_modified=response.headers.get('Last-Modified'))
+                if response.status == 200:
+                    body = await response.read()
+                    result.html = body.decode(response.charset or "utf-8", errors="replace")
+                elif response.status != 304:
+                    result.error = f"HTTP {response.status}"
+                return result
+        except Exception as e:
+            return FetchResult(url, error=e)
+
+    async def fetch_all(self, urls):
+        locks = defaultdict(asyncio.Lock)
+        last_start = defaultdict(lambda: float("-inf"))
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers={'User-Agent': self.user_agent}) as session:
+            return await asyncio.gather(*(self._fetch(session, url, locks, last_start)
+                                          for url in dict.fromkeys(urls)))
+
+    def crawl(self, urls):
+        return asyncio.run(self.fetch_all(urls))
+
+
+def get_crawler(path=".cache/crawl.sqlite3", **kwargs):
+    return Crawler(validators=get_resource(("crawl_validators", path), lambda: Validators(path)), **kwargs)
@@ -1,24 +1,28 @@
 from langchain.tools.retriever import create_retriever_tool
 from langchain.agents import AgentExecutor
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_anthropic import ChatAnthropic
-from langchain_community.llms import CTransformers
 from langchain.agents.format_scratchpad.openai_tools import (
     format_to_openai_tool_messages,
 )
 from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser
 from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, ConversationalRetrievalChain, RetrievalQAWithSourcesChain
+from langchain.chains import ConversationalRetrievalChain, RetrievalQAWithSourcesChain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 
+from utils.llm_factory import get_chat_llm
+from utils.bm25_index import get_keyword_index
+from utils.context_packer import context_packer_for
+from utils.reranker import get_reranker
+from utils.retrievers import FanOutRetriever, build_retriever
+
 MEMORY_KEY = "chat_history"
 
 
-def create_agent_executor(astra_vector_store, openai_api_key, stream_handler):
-    retriever = astra_vector_store.as_retriever(search_kwargs={"k": 3})
+def create_agent_executor(astra_vector_store, openai_api_key):
+    # Built once and shared through the registry; the page attaches its stream handler per invocation
+    # (config={"callbacks": [...]}), which reaches the LLM through the run's callback manager.
+    retriever = build_retriever(astra_vector_store, k=3)
 
     retriever_tool = create_retriever_tool(
         retriever,
@@ -40,13 +44,7 @@ def create_agent_executor(astra_vector_store, openai_api_key, stream_handler):
             MessagesPlaceholder(variable_name="agent_scratchpad"),
         ]
     )
-    chat_llm = ChatOpenAI(
-        model_name="gpt-4-turbo-preview",
-        openai_api_key=openai_api_key,
-        temperature=0.5,
-        streaming=True,
-        callbacks=[stream_handler],
-    )
+    chat_llm = get_chat_llm('OpenAI', openai_api_key, temperature=0.5, streaming=True)
 
     tools = [retriever_tool]
     llm_with_tools = chat_llm.bind_tools(tools)
@@ -69,12 +67,8 @@ def create_agent_executor(astra_vector_store, openai_api_key, stream_handler):
     return agent_executor
 
 
-def create_retriever_chain(astra_vector_store, openai_api_key):
-    openai_chat_llm = ChatOpenAI(
-        model_name="gpt-4-turbo-preview",
-        openai_api_key=openai_api_key,
-        temperature=0.5,
-    )
+def create_retriever_chain(astra_vector_store, openai_api_key, context_tokens=None, reranker=None):
+    openai_chat_llm = get_chat_llm('OpenAI', openai_api_key, temperature=0.5)
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are very powerful assistant that can answer questions about diseases and also diagnose users \
@@ -92,19 +86,28 @@ def create_retriever_chain(astra_vector_store, openai_api_key):
         prompt=prompt,
     )
 
-    retriever = astra_vector_store.as_retriever()
+    # The best chunks, deduplicated and compressed to fit the context token budget. With a reranker, 20 candidates
+    # are reranked and only the best 4 go on to the prompt.
+    retriever = build_retriever(astra_vector_store,
+                                k=4 if reranker else 8,
+                                reranker=get_reranker(reranker),
+                                packer=context_packer_for('OpenAI', context_tokens),
+                                name="retriever_chain")
 
     retrieval_chain = create_retrieval_chain(retriever, chain)
 
     return retrieval_chain
 
 
-def create_history_aware_retriever_chain(astra_vector_store, openai_api_key):
-    openai_chat_llm = ChatOpenAI(
-        model_name="gpt-4-turbo-preview",
-        openai_api_key=openai_api_key,
-        temperature=0.5,
-    )
+def create_history_aware_retriever_chain(astra_vector_store,
+                                         openai_api_key,
+                                         rewrite_model=None,
+                                         context_tokens=None,
+                                         reranker=None):
+    openai_chat_llm = get_chat_llm('OpenAI', openai_api_key, temperature=0.5)
+    # Rewriting a follow-up into a search query is a much easier task than answering, so it can go to a cheaper model.
+    rewrite_llm = get_chat_llm('OpenAI', openai_api_key, temperature=0.5, model_name=rewrite_model) \
+        if rewrite_model else openai_chat_llm
 
     prompt = ChatPromptTemplate.from_messages([
         ("system", "You are very powerful assistant that can answer questions about diseases and also diagnose users \
@@ -123,8 +126,6 @@ def create_history_aware_retriever_chain(astra_vector_store, openai_api_key):
         prompt=prompt,
     )
 
-    retriever = astra_vector_store.as_retriever()
-
     retriever_prompt = ChatPromptTemplate.from_messages([
         MessagesPlaceholder(variable_name="chat_history"),
         ("human", "{input}"),
@@ -133,16 +134,22 @@ def create_history_aware_retriever_chain(astra_vector_store, openai_api_key):
          "the conversation")
     ])
 
-    history_aware_retriever = create_history_aware_retriever(
-        llm=openai_chat_llm,
-        retriever=retriever,
+    # Searches the original question and its rewrite, each dense and keyword, concurrently.
+    history_aware_retriever = FanOutRetriever(
+        astra_vector_store,
+        get_keyword_index(),
+        llm=rewrite_llm,
         prompt=retriever_prompt,
+        name="history_aware_retriever",
+        reranker=get_reranker(reranker),
+        packer=context_packer_for('OpenAI', context_tokens),
+        k=4 if reranker else 8,
     )
 
     retrieval_chain = create_retrieval_chain(
-        history_aware_retriever,
+        history_aware_retriever.as_runnable(),
         chain,
-    )
+    ).with_config(run_name="history_aware_retrieval_chain")
 
     return retrieval_chain
 
@@ -151,38 +158,34 @@ def create_conversational_retrieval_chain(astra_vector_store,
                                           openai_api_key,
                                           google_api_key,
                                           claude_api_key,
-                                          model='OpenAI'):
-    openai_chat_llm = ChatOpenAI(
-        model_name="gpt-4-turbo-preview",
-        openai_api_key=openai_api_key,
-        temperature=0.5,
-    )
-    google_chat_llm = ChatGoogleGenerativeAI(
-        google_api_key=google_api_key,
-        model="gemini-pro",
-        temperature=0.5,
-        convert_system_message_to_human=True,
-    )
-
-    claude_chat_llm = ChatAnthropic(
-        temperature=0.5,
-        api_key=claude_api_key,
-        model_name="claude-3-opus-20240229"
-    )
-
+                                          model='OpenAI',
+                                          streaming=False,
+                                          rewrite_model=None,
+                                          context_tokens=None,
+                                          reranker=None):
+    # Only the selected backend is imported and built; the client is shared with every other chain using it.
     if model == 'OpenAI':
-        chat_llm = openai_chat_llm
+        provider, api_key = 'OpenAI', openai_api_key
     elif model == 'Google':
-        chat_llm = google_chat_llm
+        provider, api_key = 'Google', google_api_key
     else:
-        chat_llm = claude_chat_llm
+        provider, api_key = 'Claude', claude_api_key
+    chat_llm = get_chat_llm(provider, api_key, temperature=0.5, streaming=streaming)
 
+    # With streaming, tokens reach the callbacks passed when calling the chain. The question condenser keeps a
+    # non-streaming client so that only the answer is streamed to the user, and may use a cheaper model. Retrieved
+    # chunks are packed into the provider's context token budget instead of being cut off at a fixed limit.
+    condense_kwargs = {"model_name": rewrite_model} if rewrite_model else {}
     chain = ConversationalRetrievalChain.from_llm(
         chat_llm,
-        retriever=astra_vector_store.as_retriever(),
+        condense_question_llm=get_chat_llm(provider, api_key, temperature=0.5, **condense_kwargs),
+        retriever=build_retriever(astra_vector_store,
+                                  k=4 if reranker else 8,
+                                  reranker=get_reranker(reranker),
+                                  packer=context_packer_for(provider, context_tokens),
+                                  name=f"conversational_retriever_{provider}"),
         chain_type="stuff",
         verbose=True,
-        max_tokens_limit=150,
         return_source_documents=True,
     )
     return chain
@@ -1,33 +1,94 @@
-import streamlit as st
-import os
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import json
 from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_community.document_loaders import UnstructuredHTMLLoader
-from langchain_community.document_loaders import JSONLoader
 from langchain_community.document_loaders import UnstructuredMarkdownLoader
 from langchain_community.document_loaders import PyPDFLoader
-from tempfile import NamedTemporaryFile
+from langchain_community.document_loaders.blob_loaders import Blob
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
 from newspaper import Article
-import requests
-import time
 
+from utils.chunking import get_chunker
+from utils.crawler import get_crawler
+from utils.manifest import content_hash, sync_source
+
+
+def iter_json_array(file_path, block_size=1 << 20):
+    # Yields the elements of a top-level JSON array one at a time, reading the file in blocks, so memory holds one
+    # element instead of the whole document. Any other top-level value is loaded whole; an object yields its values,
+    # as jq's '.[]' does.
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding="utf-8") as f:
+        buffer = f.read(block_size).lstrip()
+        if not buffer.startswith("["):
+            data = json.loads(buffer + f.read())
+            yield from (data.values() if isinstance(data, dict) else data)
+            return
+        position, eof = 1, False
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            value = end = None
+            if position < len(buffer):
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if eof:
+                        raise
+            # An element cut off at the end of the block needs more input, and so does a number that is not followed
+            # by a delimiter yet ("12." may be "12.5"). Reads grow with the buffer so that one huge element is still
+            # decoded in linear time.
+            if end is None or (not eof and (end == len(buffer) or buffer[end] not in " \t\r\n,]")):
+                if eof:
+                    raise ValueError(f"Unterminated JSON array in {file_path}")
+                more = f.read(max(block_size, len(buffer) - position))
+                eof = not more
+                buffer, position = buffer[position:] + more, 0
+                continue
+            yield value
+            position = end
+
+
+def json_text(record):
+    # page_content as JSONLoader(text_content=False) builds it.
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        return json.dumps(record) if record else ""
+    return str(record) if record is not None else ""
+
+
+class LazyPyPDFLoader(PyPDFLoader):
+    # PyPDFLoader.lazy_load parses every page before yielding the first one; lazy_parse yields them one at a time.
+    def lazy_load(self):
+        yield from self.parser.lazy_parse(Blob.from_path(self.file_path))
 
-def handle_load_error(loader):
-    if loader:
-        st.error(f"Error occurred in loader {loader}")
-    else:
-        st.error("Loader is not initialized")
+
+class JSONArrayLoader(BaseLoader):
+    # The documents of JSONLoader(jq_schema='.[]', text_content=False), read one record at a time and without jq.
+    def __init__(self, file_path, metadata_func=None):
+        self.file_path = file_path
+        self.metadata_func = metadata_func
+
+    def lazy_load(self):
+        for seq_num, record in enumerate(iter_json_array(self.file_path), 1):
+            metadata = {"source": str(self.file_path), "seq_num": seq_num}
+            if self.metadata_func is not None:
+                metadata = self.metadata_func(record, metadata)
+            yield Document(page_content=json_text(record), metadata=metadata)
 
 
 def get_loader_for_file(file_path):
+    # Every loader is used through lazy_load. CSV rows, PDF pages and JSON records are read one at a time; the
+    # Unstructured HTML and Markdown loaders parse the whole file, which is fine at the size of a web page.
     if file_path.endswith('.csv'):
         return CSVLoader(file_path, encoding="utf-8")
     elif file_path.endswith('.pdf'):
-        return PyPDFLoader(file_path)
+        return LazyPyPDFLoader(file_path)
     elif file_path.endswith('.json'):
-        return JSONLoader(file_path=file_path,
-                          jq_schema='.[]',
-                          text_content=False)
+        return JSONArrayLoader(file_path)
     elif file_path.endswith('.html'):
         return UnstructuredHTMLLoader(file_path)
     elif file_path.endswith('.md'):
@@ -36,59 +97,47 @@ def get_loader_for_file(file_path):
         raise ValueError("Unsupported file type")
 
 
-def populate_vector_store(uploaded_file, astra_vector_store):
-    with NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-        tmp_file.write(uploaded_file.getbuffer())
-        tmp_file_path = tmp_file.name
-    try:
-        loader = get_loader_for_file(tmp_file_path)
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=800,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        docs = loader.load_and_split(text_splitter)
-        embedded_docs = [doc.page_content for doc in docs]
-        astra_vector_store.add_texts(embedded_docs)
-    except ValueError as ve:
-        st.error(f"Unsupported file type: {ve}")
-    except Exception as e:
-        handle_load_error(loader if 'loader' in locals() else None)
-    os.unlink(tmp_file_path)
+def iter_file_chunks(file_path, source, chunker=None):
+    # (text, metadata) chunks, produced as the file is read; sync_source writes them in bounded batches, so the
+    # whole file is never held in memory. Chunks keep the loader's page / row / seq_num and get their offset in it.
+    loader = get_loader_for_file(file_path)
+    chunker = chunker or get_chunker()
+    for doc in loader.lazy_load():
+        yield from chunker.split(doc.page_content, {**doc.metadata, "source": source})
 
 
-def scrape_link(url, astra_vector_store):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.82 Safari/537.36'
-    }
-    session = requests.Session()
-    pages_content = []  # where we save the scraped article
-
-    try:
-        time.sleep(2)  # sleep two seconds for gentle scraping
-        response = session.get(url, headers=headers, timeout=10)
-
-        if response.status_code == 200:
-            article = Article(url)
-            article.download()  # download HTML of webpage
+def scrape_links(urls, astra_vector_store, crawler=None, chunker=None):
+    # Pages are fetched once each, concurrently and with per-host politeness (see utils/crawler.py), and the article
+    # is parsed from the fetched HTML. Pages that answer 304 to the validators saved by their last ingestion are
+    # skipped; validators are only saved once a page's chunks are in the store.
+    crawler = crawler or get_crawler()
+    chunker = chunker or get_chunker()
+    results = crawler.crawl(urls)
+
+    for result in results:
+        if not result.ok:
+            if result.error:
+                print(f"Error occurred while fetching article at {result}")
+            continue
+        try:
+            article = Article(result.url)
+            article.download(input_html=result.html)
             article.parse()  # parse HTML to extract the article text
-            pages_content.append({"url": url, "text": article.text})
-        else:
-            print(f"Failed to fetch article at {url}")
-    except Exception as e:
-        print(f"Error occurred while fetching article at {url}: {e}")
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=200, length_function=len)
-
-    all_texts, all_metadatas = [], []
-    for d in pages_content:
-        chunks = text_splitter.split_text(d["text"])
-        for chunk in chunks:
-            all_texts.append(chunk)
-            all_metadatas.append({"source": d["url"]})
-    astra_vector_store.add_texts(all_texts, all_metadatas)
-
-
-# if __name__ == '__main__':
-#     astra_vector_store = initialize_vector_store(st.secrets['ASTRA_DB_APPLICATION_TOKEN'], st.secrets['ASTRA_DB_ID'])
-#     populate_vector_store('Documents/budget_speech.pdf', astra_vector_store)
+            sync_source(astra_vector_store,
+                        result.url,
+                        chunker.split(article.text, {"source": result.url}),
+                        digest=content_hash(article.text))
+        except Exception as e:
+            result.error = e
+            print(f"Error occurred while processing article at {result}")
+            continue
+        if crawler.validators is not None:
+            crawler.validators.remember(result)
+    return results
+
+
+def scrape_link(url, astra_vector_store):
+    result = scrape_links([url], astra_vector_store)[0]
+    if result.error:
+        raise RuntimeError(str(result))
+    return result
@@ -0,0 +1,149 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an embeddings client with a two-tier cache keyed by sha256(model name + text): an in-memory LRU
+    # in front of a local SQLite table that survives restarts. The SQLite tier is trimmed to max_disk_bytes by
+    # least recent use. Vectors are stored as float32, which is plenty for cosine similarity.
+    def __init__(self,
+                 embedding,
+                 model_name=None,
+                 path=".cache/embeddings.sqlite3",
+                 memory_items=2048,
+                 max_disk_bytes=512 * 1024 * 1024):
+        self.embedding = embedding
+        self.model_name = model_name or getattr(embedding, "model", None) or type(embedding).__name__
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                           "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, "
+                           "last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._disk_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys):
+        found = {}
+        on_disk = []
+        for key in keys:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                found[key] = self._memory[key]
+                self.memory_hits += 1
+            else:
+                on_disk.append(key)
+        # SQLite caps the number of bound parameters, so look keys up in slices.
+        for start in range(0, len(on_disk), 500):
+            batch = on_disk[start:start + 500]
+            rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                                      batch).fetchall()
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector
+                self._remember(key, vector)
+                self.disk_hits += 1
+            if rows:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key, _ in rows])
+        self._conn.commit()
+        return found
+
+    def _store(self, entries):
+        now = time.time()
+        rows = []
+        for key, vector in entries.items():
+            self._remember(key, vector)
+            blob = vector.tobytes()
+            rows.append((key, blob, len(blob), now))
+            self._disk_bytes += len(blob)
+        # A key that is already on disk (the same text embedded by two threads, or by another process sharing the
+        # file) is replaced, not added; its old size is taken off again.
+        keys = list(entries)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            self._disk_bytes -= self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch).fetchone()[0]
+        self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)",
+                               rows)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        # Drop the least recently used rows until the table is back under 90% of its budget, so that we do not
+        # evict again on the very next insert.
+        target = int(self.max_disk_bytes * 0.9)
+        while self._disk_bytes > target:
+            rows = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used LIMIT 256").fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", [(key,) for key, _ in rows])
+            self._disk_bytes -= sum(size for _, size in rows)
+
+    def _embed(self, texts, embed_missing):
+        keys = [self._key(text) for text in texts]
+        with self._lock:
+            found = self._lookup(set(keys))
+        # Identical texts inside one batch are only sent once.
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = embed_missing(list(missing.values()))
+            computed = {key: array("f", vector) for key, vector in zip(missing, vectors)}
+            with self._lock:
+                self.misses += len(computed)
+                self._store(computed)
+            found.update(computed)
+        return [list(found[key]) for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), self.embedding.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], lambda texts: [self.embedding.embed_query(texts[0])])[0]
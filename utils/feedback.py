@@ -0,0 +1,197 @@
+import hashlib
+import json
+import queue
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from trulens_eval import TruChain, OpenAI
+from trulens_eval.feedback.provider.openai import OpenAI as fOpenAI
+from trulens_eval import Feedback
+from trulens_eval.app import App
+
+from utils.registry import get_resource
+from utils.tracing import traced
+
+
+# Metrics scored by the custom grader, all in one request: name -> question asked about each turn.
+GRADER_METRICS = {
+    "answered": "Does the RESPONSE provide an answer to the QUESTION?",
+    "correctness": "How factually correct is the RESPONSE to the QUESTION?",
+}
+GRADER_PROMPT = ("You grade a healthcare assistant. For every item, rate each metric on a scale of 1 to 10:\n"
+                 + "\n".join(f"- {name}: {question}" for name, question in GRADER_METRICS.items())
+                 + '\nRespond with JSON only: {"grades": [{"id": <item id>, '
+                 + ", ".join(f'"{name}": <1-10>' for name in GRADER_METRICS) + "}]}")
+
+_grades = OrderedDict()
+_pending = {}
+_grades_lock = threading.Lock()
+
+
+def _grade_key(question, response):
+    return hashlib.sha256(f"{question}\0{response}".encode("utf-8")).hexdigest()
+
+
+class BatchedGrader(fOpenAI):
+    # Scores every metric in GRADER_METRICS with one structured GPT-4 call, for one or several turns at a time.
+    # Grades are cached by (question, response) hash, and concurrent requests for the same turn (TruLens runs the
+    # feedback functions of a record in parallel) wait for the call already in flight instead of repeating it.
+    def grade_many(self, pairs):
+        keys = [_grade_key(question, response) for question, response in pairs]
+        todo, waiting = {}, []
+        with _grades_lock:
+            for key, pair in zip(keys, pairs):
+                if key in _grades or key in todo:
+                    continue
+                if key in _pending:
+                    waiting.append(_pending[key])
+                else:
+                    todo[key] = pair
+                    _pending[key] = threading.Event()
+        try:
+            if todo:
+                self._request(todo)
+        finally:
+            with _grades_lock:
+                for key in todo:
+                    _pending.pop(key).set()
+        for event in waiting:
+            event.wait()
+        with _grades_lock:
+            return [_grades.get(key) for key in keys]
+
+    def _request(self, todo):
+        items = [{"id": i, "question": question, "response": response}
+                 for i, (question, response) in enumerate(todo.values())]
+        content = self.endpoint.client.chat.completions.create(
+            model="gpt-4-turbo-preview",
+            response_format={"type": "json_object"},
+            messages=[
+                {"role": "system", "content": GRADER_PROMPT},
+                {"role": "user", "content": json.dumps(items)}
+            ]
+        ).choices[0].message.content
+        keys = list(todo)
+        with _grades_lock:
+            for grade in json.loads(content)["grades"]:
+                _grades[keys[int(grade["id"])]] = {name: float(grade[name]) / 10 for name in GRADER_METRICS}
+            while len(_grades) > 4096:
+                _grades.popitem(last=False)
+
+    def _metric(self, question, response, name):
+        grade = self.grade_many([(question, response)])[0]
+        if grade is None:
+            raise ValueError(f"Grader returned no {name} score")
+        return grade[name]
+
+    def no_answer_feedback(self, question: str, response: str) -> float:
+        return self._metric(question, response, "answered")
+
+    def answer_feedback(self, question: str, response: str) -> float:
+        return self._metric(question, response, "correctness")
+
+
+def get_grader():
+    return get_resource(("grader",), BatchedGrader)
+
+
+def create_feedbacks(chain):
+    # Initialize provider class
+    openai = OpenAI()
+
+    # select context to be used in feedback. the location of context is app specific.
+    context = App.select_context(chain)
+
+    # Question/answer relevance between overall question and answer.
+    f_qa_relevance = Feedback(openai.relevance, name="Relevance between Q/A").on_input_output()
+
+    # Question/statement relevance between question and each context chunk.
+    f_context_relevance = (
+        Feedback(openai.context_relevance, name="Relevance between Q and Context")
+        .on_input()
+        .on(context)
+        .aggregate(np.mean)
+    )
+
+    custom = get_grader()
+
+    # No answer feedback (custom). Both read the same cached grade, so a turn costs a single grader call.
+    f_no_answer = Feedback(custom.no_answer_feedback, name="Accuracy between Q/A").on_input_output()
+    f_answer = Feedback(custom.answer_feedback, name="Groundedness").on_input_output()
+
+    return [f_qa_relevance, f_context_relevance, f_no_answer, f_answer]
+
+
+def create_recorder(chain, app_id):
+    # The recorder only captures the record; feedback is computed by a FeedbackWorker off the request path.
+    return TruChain(
+        chain,
+        app_id=app_id,
+        feedbacks=create_feedbacks(chain),
+        feedback_mode="none",
+    )
+
+
+class FeedbackWorker:
+    # Scores records in background threads fed by a bounded queue, so the answer is returned to the user as soon
+    # as the chain finishes. Only sample_rate of the submitted turns are scored; when the queue is full new records
+    # are dropped rather than slowing the page down. Each result is written to the TruLens database as soon as it is
+    # computed. Records waiting in the queue are graded together, up to grade_batch_size turns per grader call.
+    # With a tracer, grading and evaluation are traced as feedback_grading / trulens_feedback spans.
+    def __init__(self, tru, recorder, sample_rate=1.0, workers=2, max_queue=64, grade_batch_size=8, tracer=None):
+        self.tru = tru
+        self.recorder = recorder
+        self.tracer = tracer
+        self.sample_rate = sample_rate
+        self.grade_batch_size = grade_batch_size
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.submitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        for _ in range(workers):
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, record):
+        self.submitted += 1
+        if random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.grade_batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with traced([self.tracer], "feedback_grading", records=len(records)):
+                    get_grader().grade_many([(str(record.main_input), str(record.main_output)) for record in records])
+            except Exception as e:
+                # The feedback functions grade each turn on their own if the batched call fails.
+                print(f"Batched grading failed: {e}")
+            for record in records:
+                self._evaluate(record)
+
+    def _evaluate(self, record):
+        try:
+            with traced([self.tracer], "trulens_feedback"):
+                for result in self.tru.run_feedback_functions(record, self.recorder.feedbacks, app=self.recorder):
+                    self.tru.add_feedback(result)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Feedback evaluation failed for record {record.record_id}: {e}")
+        finally:
+            self.queue.task_done()
@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from tempfile import NamedTemporaryFile
+
+import streamlit as st
+
+from utils.data_loader import iter_file_chunks
+from utils.manifest import content_hash, get_manifest, sync_source, upload_source
+from utils.registry import get_resource
+
+
+class IngestionJob:
+    # One uploaded file. Counters are updated by the worker thread and only read by the pages.
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = "queued"
+        self.parsed = 0
+        self.embedded = 0
+        self.written = 0
+        self.kept = 0
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def advance(self, stage, count):
+        setattr(self, stage, getattr(self, stage) + count)
+
+    @property
+    def done(self):
+        return self.state in ("done", "unchanged", "failed")
+
+    @property
+    def fraction(self):
+        if self.done:
+            return 1.0
+        if not self.parsed:
+            return 0.0
+        # Share of the chunks parsed so far that are in the store (chunks that were already there count as written).
+        return min((self.written + self.kept) / self.parsed, 1.0)
+
+    def __str__(self):
+        if self.state == "failed":
+            return f"{self.name}: failed ({self.error})"
+        if self.state == "unchanged":
+            return f"{self.name}: already ingested"
+        return (f"{self.name}: {self.state}, {self.parsed} chunks parsed, {self.embedded} embedded, "
+                f"{self.written} written" + (f", {self.kept} unchanged" if self.kept else ""))
+
+
+class IngestionQueue:
+    # Uploads are handed to a background worker instead of being ingested inside the Streamlit script, so the chat
+    # stays responsive while a large PDF is parsed and embedded. Jobs are keyed by the hash of the file contents:
+    # Streamlit keeps returning the same upload on every rerun, and submitting it again returns the existing job.
+    def __init__(self, astra_vector_store, workers=1, max_jobs=256):
+        self.astra_vector_store = astra_vector_store
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"ingestion-{i}", daemon=True).start()
+
+    def submit(self, name, data):
+        job_id = content_hash(data)
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id]
+            job = self._jobs[job_id] = IngestionJob(job_id, name)
+            # Forget the oldest finished jobs; resubmitting one of those is still cheap, the manifest skips it.
+            finished = [old_id for old_id, old in self._jobs.items() if old.done]
+            for old_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+                del self._jobs[old_id]
+        self._queue.put((job, data))
+        return job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _work(self):
+        while True:
+            job, data = self._queue.get()
+            try:
+                self._ingest(job, data)
+            except Exception as e:
+                job.error = e
+                job.state = "failed"
+            job.finished = time.time()
+
+    def _ingest(self, job, data):
+        if get_manifest().is_unchanged(upload_source(job.name), job.id):
+            job.state = "unchanged"
+            return
+        job.state = "parsing"
+        with NamedTemporaryFile(delete=False, suffix=os.path.splitext(job.name)[1]) as tmp_file:
+            tmp_file.write(data)
+            tmp_file_path = tmp_file.name
+        try:
+            # Parsing, embedding and writing are interleaved: chunks are produced as the file is read and written
+            # in bounded batches.
+            job.state = "indexing"
+            sync_source(self.astra_vector_store, upload_source(job.name), self._count(job, tmp_file_path),
+                        digest=job.id, progress=job.advance)
+        finally:
+            os.unlink(tmp_file_path)
+        job.state = "done"
+
+    def _count(self, job, file_path):
+        for chunk in iter_file_chunks(file_path, job.name):
+            job.parsed += 1
+            yield chunk
+
+
+def get_ingestion_queue(astra_vector_store):
+    return get_resource(("ingestion_queue", id(astra_vector_store)), lambda: IngestionQueue(astra_vector_store))
+
+
+def _show_jobs(jobs):
+    for job in jobs:
+        if job.state == "failed":
+            st.error(str(job))
+        else:
+            st.progress(job.fraction, text=str(job))
+
+
+@st.experimental_fragment(run_every=1)
+def _poll_ingestion_progress(ingestion_queue, limit):
+    # Re-runs on its own every second without rerunning the rest of the page, so progress updates while the user
+    # keeps chatting. Once the last job has finished, one full rerun hands over to the static render below and
+    # the polling stops.
+    jobs = ingestion_queue.jobs()[-limit:]
+    _show_jobs(jobs)
+    if all(job.done for job in jobs):
+        st.rerun()
+
+
+def show_ingestion_progress(ingestion_queue, limit=5):
+    jobs = ingestion_queue.jobs()[-limit:]
+    if any(not job.done for job in jobs):
+        _poll_ingestion_progress(ingestion_queue, limit)
+    else:
+        _show_jobs(jobs)
@@ -1,10 +1,22 @@
+import uuid
+
 from langchain_community.vectorstores import Cassandra
 from langchain_openai import OpenAIEmbeddings
 import cassio
 
+from utils.embedding_cache import CachedEmbeddings
+
 
-def initialize_vector_store(astra_db_application_token, astra_db_id):
-    embedding = OpenAIEmbeddings()
+def initialize_vector_store(astra_db_application_token, astra_db_id, backend="astra"):
+    # Both add_texts (ingestion) and the retrievers (query embedding) go through store.embedding, so wrapping
+    # it here caches both paths.
+    embedding = CachedEmbeddings(OpenAIEmbeddings())
+    if backend == "local":
+        # On-disk IVF index under .cache/, no database needed (see utils/local_vector_store.py).
+        from utils.local_vector_store import LocalVectorStore
+        return LocalVectorStore(embedding)
+    if backend != "astra":
+        raise ValueError(f"Unknown vector store backend: {backend}")
     cassio.init(token=astra_db_application_token, database_id=astra_db_id)
     astra_vector_store = Cassandra(
         embedding=embedding,
@@ -13,3 +25,20 @@ def initialize_vector_store(astra_db_application_token, astra_db_id):
         keyspace=None,
     )
     return astra_vector_store
+
+
+def add_embeddings(astra_vector_store, texts, embeddings, metadatas=None, ids=None):
+    # Write rows whose vectors were computed up front (bulk ingestion embeds concurrently on its own).
+    # Stores that support it natively are used as is; langchain's Cassandra store only offers add_texts, which
+    # would embed again, so rows are written through the cassio table it wraps, exactly as add_texts does.
+    metadatas = metadatas or [{} for _ in texts]
+    ids = ids or [uuid.uuid4().hex for _ in texts]
+    if hasattr(astra_vector_store, "add_embeddings"):
+        return astra_vector_store.add_embeddings(texts, embeddings, metadatas, ids)
+    futures = [
+        astra_vector_store.table.put_async(row_id=row_id, body_blob=text, vector=vector, metadata=metadata or {})
+        for row_id, text, vector, metadata in zip(ids, texts, embeddings, metadatas)
+    ]
+    for future in futures:
+        future.result()
+    return ids
@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from utils.registry import get_resource
+from utils.rewrite_gate import needs_rewrite
+
+# Local fast path in front of the chains. Small talk and questions that are clearly not about healthcare are answered
+# from a template instead of paying for retrieval and a GPT-4 call, which would only greet or politely refuse anyway
+# (see the system prompts in utils/create_chains.py). Everything else goes to the chain as before.
+_WORD = re.compile(r"[a-z0-9']+")
+
+TEMPLATES = {
+    'greeting': "Hello! I'm a healthcare assistant. Ask me about diseases, symptoms or treatments, or describe your "
+                "symptoms and I'll help you make sense of them.",
+    'thanks': "You're welcome! Let me know if you have any other health questions.",
+    'goodbye': "Goodbye, take care! Come back any time you have a health question.",
+    'off_topic': "I'm a healthcare assistant, so I can only help with healthcare-related topics. Is there anything "
+                 "about your health I can help you with?",
+}
+
+# intent -> (words one of which must appear, words that may appear around them). A message is small talk only if
+# every word in it belongs to the intent, so "hi, what causes asthma?" still goes to the chain.
+SMALL_TALK_RULES = {
+    'greeting': (frozenset("hi hello hey hiya howdy greetings yo morning afternoon evening".split()),
+                 frozenset("good there everyone all bot chatbot assistant doc doctor how are you u r doing today is it "
+                           "going what's whats up sup nice to meet".split())),
+    'thanks': (frozenset("thanks thank thx ty cheers appreciate appreciated".split()),
+               frozenset("you so much very a lot lots for the help that this it that's was is great perfect awesome "
+                         "helpful ok okay i really".split())),
+    'goodbye': (frozenset("bye goodbye cya farewell later".split()),
+                frozenset("see you good night take care have a nice day ok okay thanks for now".split())),
+}
+
+# Topics the assistant refuses. A message is refused by the rules only if every content word in it is one of these or
+# a word that commonly goes with them; one health word ("Can cold weather make my joints hurt?") sends it on to the
+# classifier or the chain.
+OFF_TOPIC_WORDS = frozenset(
+    "weather forecast stock stocks bitcoin crypto cryptocurrency football soccer basketball baseball nba nfl cricket "
+    "movie movies film netflix song songs lyrics election president politics joke poem programming celebrity "
+    "horoscope lottery".split())
+OFF_TOPIC_CONTEXT = frozenset(
+    "today tomorrow tonight weekend week year next last night price prices buy sell invest won win game games match "
+    "score scores team finals season watch recommend write tell funny latest news new good best top".split())
+# Words that carry no topic of their own.
+STOP_WORDS = frozenset(
+    "a an the i me my we our you your he she it its they them this that these those is are was were be been am do "
+    "does did can could should would will shall may might must have has had what what's whats who whom which where "
+    "when why how to of in on at for with about from by as and or but if so not no please some any like make "
+    "get give know think want".split())
+
+# Example utterances whose mean embeddings are the classifier's centroids. 'healthcare' is never answered locally;
+# its centroid is what a small-talk or off-topic match has to beat.
+EXAMPLES = {
+    'greeting': ["hi", "hello there", "hey, how are you?", "good morning", "hello, who are you?",
+                 "hi, what can you do?", "hey there, nice to meet you"],
+    'thanks': ["thank you", "thanks a lot", "thanks, that was helpful", "great, thank you so much",
+               "I appreciate it", "perfect, thanks"],
+    'goodbye': ["bye", "goodbye", "see you later", "that's all for today, bye", "have a nice day"],
+    'off_topic': ["what's the weather like tomorrow?", "who won the football game last night?",
+                  "recommend a good movie", "what is the price of bitcoin?", "write me a poem about the sea",
+                  "what is the capital of France?", "how do I reverse a list in python?", "tell me a joke",
+                  "who is the president of the united states?", "what stocks should I buy?"],
+    'healthcare': ["what are the symptoms of diabetes?", "how is asthma treated?", "I have a headache and a fever",
+                   "what causes high blood pressure?", "is migraine hereditary?", "side effects of ibuprofen",
+                   "my child has a rash and a cough, what could it be?", "how can I sleep better?",
+                   "what is the ICD-10 code for hypertension?", "how long does the flu last?",
+                   "which foods should people with gout avoid?", "what vaccines do adults need?"],
+}
+
+
+class RouterStats:
+    def __init__(self):
+        self.total = 0
+        self.handled = Counter()
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, intent, seconds):
+        with self._lock:
+            self.total += 1
+            self.seconds += seconds
+            if intent:
+                self.handled[intent] += 1
+
+    @property
+    def handled_fraction(self):
+        return sum(self.handled.values()) / self.total if self.total else 0.0
+
+    @property
+    def mean_route_seconds(self):
+        return self.seconds / self.total if self.total else 0.0
+
+    def __str__(self):
+        return (f"{sum(self.handled.values())}/{self.total} answered locally ({self.handled_fraction:.0%}): "
+                + ", ".join(f"{intent} {count}" for intent, count in self.handled.most_common()))
+
+
+router_stats = RouterStats()
+
+
+def match_rules(question):
+    words = _WORD.findall(question.lower())
+    if not words:
+        return None
+    for intent, (core, extra) in SMALL_TALK_RULES.items():
+        if any(word in core for word in words) and all(word in core or word in extra for word in words):
+            return intent
+    content = [word for word in words if word not in STOP_WORDS]
+    if any(word in OFF_TOPIC_WORDS for word in content) \
+            and all(word in OFF_TOPIC_WORDS or word in OFF_TOPIC_CONTEXT for word in content):
+        return 'off_topic'
+    return None
+
+
+class IntentRouter:
+    # Keyword rules first (microseconds); short messages the rules do not decide are then compared with the intent
+    # centroids. The classifier only answers when the best centroid is not 'healthcare' and beats it by margin, so
+    # that a doubtful case costs an LLM call rather than refusing a real question. Query vectors come from the same
+    # cached embeddings client as retrieval, so a question that goes on to the chain is not embedded twice.
+    def __init__(self, embedding=None, margin=0.05, max_words=12, stats=router_stats):
+        self.embedding = embedding
+        self.margin = margin
+        self.max_words = max_words
+        self.stats = stats
+        self._intents = None
+        self._centroids = None
+        self._lock = threading.Lock()
+
+    def _load_centroids(self):
+        with self._lock:
+            if self._centroids is None:
+                intents = list(EXAMPLES)
+                texts = [text for intent in intents for text in EXAMPLES[intent]]
+                vectors = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+                vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                centroids, start = [], 0
+                for intent in intents:
+                    centroid = vectors[start:start + len(EXAMPLES[intent])].mean(axis=0)
+                    centroids.append(centroid / np.linalg.norm(centroid))
+                    start += len(EXAMPLES[intent])
+                self._intents, self._centroids = intents, np.stack(centroids)
+        return self._intents, self._centroids
+
+    def classify(self, question):
+        intents, centroids = self._load_centroids()
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        similarities = centroids @ (vector / (np.linalg.norm(vector) or 1.0))
+        best = int(np.argmax(similarities))
+        if intents[best] == 'healthcare':
+            return None
+        if similarities[best] - similarities[intents.index('healthcare')] < self.margin:
+            return None
+        return intents[best]
+
+    def route(self, question, chat_history=None):
+        # Returns (intent, answer) for messages answered locally, None for everything the chain should handle.
+        started = time.perf_counter()
+        intent = match_rules(question)
+        if intent is None and self.embedding is not None and len(_WORD.findall(question.lower())) <= self.max_words \
+                and not needs_rewrite(question, chat_history):
+            try:
+                intent = self.classify(question)
+            except Exception as e:
+                # The router is an optimization; if the embeddings client fails, the chain answers.
+                print(f"Intent classification failed: {e}")
+        self.stats.record(intent, time.perf_counter() - started)
+        return (intent, TEMPLATES[intent]) if intent else None
+
+
+def get_intent_router(embedding=None):
+    return get_resource(("intent_router", id(embedding)), lambda: IntentRouter(embedding))
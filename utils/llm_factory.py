@@ -0,0 +1,62 @@
+import functools
+
+from utils.registry import get_resource
+
+# Provider SDKs are imported inside the builders so that a page only pays the import cost of the backend it
+# actually uses, and only the first time it asks for it.
+
+
+@functools.lru_cache(maxsize=None)
+def _streaming(chat_model_class):
+    # Not every provider integration has a `streaming` switch (ChatGoogleGenerativeAI does not), but all of them
+    # implement _stream and report each token to the callbacks from there. Routing _generate through _stream gives
+    # every provider the same token-by-token behaviour inside chains that only call generate.
+    from langchain_core.language_models.chat_models import generate_from_stream
+
+    class StreamingChatModel(chat_model_class):
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            return generate_from_stream(self._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    StreamingChatModel.__name__ = f"Streaming{chat_model_class.__name__}"
+    return StreamingChatModel
+
+
+def _build_openai(api_key, model_name="gpt-4-turbo-preview", streaming=False, **kwargs):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model_name=model_name, openai_api_key=api_key, streaming=streaming, **kwargs)
+
+
+def _build_google(api_key, model_name="gemini-pro", streaming=False, **kwargs):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    chat_model_class = _streaming(ChatGoogleGenerativeAI) if streaming else ChatGoogleGenerativeAI
+    return chat_model_class(google_api_key=api_key,
+                            model=model_name,
+                            convert_system_message_to_human=True,
+                            **kwargs)
+
+
+def _build_claude(api_key, model_name="claude-3-opus-20240229", streaming=False, **kwargs):
+    from langchain_anthropic import ChatAnthropic
+    chat_model_class = _streaming(ChatAnthropic) if streaming else ChatAnthropic
+    return chat_model_class(api_key=api_key, model_name=model_name, **kwargs)
+
+
+PROVIDERS = {
+    'OpenAI': _build_openai,
+    'Google': _build_google,
+    'Claude': _build_claude,
+}
+
+
+def build_chat_llm(provider, api_key, temperature=0.5, streaming=False, **kwargs):
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unsupported LLM provider: {provider}")
+    return PROVIDERS[provider](api_key, temperature=temperature, streaming=streaming, **kwargs)
+
+
+def get_chat_llm(provider, api_key, temperature=0.5, streaming=False, **kwargs):
+    # Cached variant of build_chat_llm. kwargs must be hashable, so per-request objects such as callbacks
+    # belong on the invocation config rather than on the client.
+    key = ("llm", provider, api_key, temperature, streaming, tuple(sorted(kwargs.items())))
+    return get_resource(key, lambda: build_chat_llm(provider, api_key, temperature=temperature, streaming=streaming,
+                                                    **kwargs))
@@ -1,45 +1,112 @@
+import argparse
+import hashlib
 import streamlit as st
 import os
-from langchain_community.document_loaders import JSONLoader
+from functools import partial
 
+from utils.bm25_index import get_keyword_index
+from utils.bulk_ingest import run_bulk_ingest
+from utils.data_loader import iter_json_array, json_text
 from utils.initialize_vector_store import initialize_vector_store
+from utils.manifest import get_manifest, prune_sources
 
 
-def handle_load_error(loader):
-    if loader:
-        st.error(f"Error occurred in loader {loader}")
-    else:
-        st.error("Loader is not initialized")
+class _Fields(dict):
+    # Missing fields render as empty strings, so one template fits records that leave some fields out.
+    def __missing__(self, key):
+        return ""
+
+
+class RecordTemplate:
+    # How a disease record becomes a document. text is a str.format template over the record's fields
+    # ("{name}\n\nSymptoms: {symptoms}"); None keeps the record's JSON, as JSONLoader(text_content=False) does, so
+    # chunk ids (and the manifest) stay the same as before. metadata maps metadata keys to record fields.
+    def __init__(self, text=None, metadata=None):
+        self.text = text
+        self.metadata = {"source": "link"} if metadata is None else metadata
+
+    def render(self, record):
+        if not isinstance(record, dict):
+            return json_text(record), {}
+        if self.text is None:
+            text = json_text(record)
+        else:
+            text = self.text.format_map(_Fields({key: "" if value is None else value for key, value in record.items()}))
+        return text, {key: record.get(field) for key, field in self.metadata.items()}
+
+
+DEFAULT_TEMPLATE = RecordTemplate()
 
 
-def metadata_func(record: dict, metadata: dict) -> dict:
-    metadata["source"] = record.get("link")
-    return metadata
+def load_records(file_path, template=DEFAULT_TEMPLATE):
+    # [(text, metadata), ...] of one file. Module-level (and template picklable) so it runs in worker processes.
+    return [template.render(record) for record in iter_json_array(file_path)]
 
 
-def populate_vector_store(file_path, astra_vector_store):
-    try:
-        loader = JSONLoader(file_path=file_path,
-                            jq_schema='.[]',
-                            text_content=False,
-                            metadata_func=metadata_func)
-        docs = loader.load()
-        embedded_docs = [doc.page_content for doc in docs]
-        astra_vector_store.add_texts(embedded_docs)
-        print(f'Loaded file {file_path}')
-    except ValueError as ve:
-        st.error(f"Unsupported file type: {ve}")
-    except Exception as e:
-        handle_load_error(loader if 'loader' in locals() else None)
+class _HashEmbeddings:
+    # Deterministic stand-in for OpenAIEmbeddings used by --dry-run to measure the pipeline itself.
+    def __init__(self, size=1536):
+        self.size = size
+
+    def embed_documents(self, texts):
+        return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()] * (self.size // 32)
+                for text in texts]
+
+
+def list_files(folder_paths):
+    return [os.path.join(folder_path, filename)
+            for folder_path in folder_paths
+            for filename in sorted(os.listdir(folder_path))]
 
 
 if __name__ == '__main__':
-    astra_vector_store = initialize_vector_store(st.secrets['ASTRA_DB_APPLICATION_TOKEN'], st.secrets['ASTRA_DB_ID'])
-    folder_path = '../SWM'
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        populate_vector_store(file_path, astra_vector_store)
-    folder_path = '../data'
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        populate_vector_store(file_path, astra_vector_store)
+    parser = argparse.ArgumentParser(description="Bulk load the healthcare JSON corpus into the vector store.")
+    parser.add_argument("folders", nargs="*", default=['../SWM', '../data'])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--in-flight", type=int, default=4, help="concurrent embedding requests")
+    parser.add_argument("--parse-workers", type=int, default=None)
+    parser.add_argument("--text-template", default=None,
+                        help="str.format template over record fields for the document text (default: the record JSON)")
+    parser.add_argument("--metadata", nargs="*", default=None, metavar="KEY=FIELD",
+                        help="metadata keys and the record fields they come from (default: source=link)")
+    parser.add_argument("--dry-run", action="store_true", help="use a fake embedder and discard the output")
+    parser.add_argument("--full", action="store_true", help="re-index every file, even unchanged ones")
+    parser.add_argument("--backend", choices=["astra", "local"], default=None,
+                        help="vector store to load into (default: VECTOR_STORE_BACKEND from the secrets, else astra)")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        astra_vector_store = None
+        embedder = _HashEmbeddings()
+        write_batch = lambda texts, vectors, metadatas, ids: None
+    else:
+        backend = args.backend or st.secrets.get('VECTOR_STORE_BACKEND', 'astra')
+        astra_vector_store = initialize_vector_store(st.secrets.get('ASTRA_DB_APPLICATION_TOKEN'),
+                                                     st.secrets.get('ASTRA_DB_ID'),
+                                                     backend=backend)
+        embedder = astra_vector_store.embedding
+        write_batch = None
+
+    template = RecordTemplate(args.text_template,
+                              None if args.metadata is None else dict(item.split("=", 1) for item in args.metadata))
+    file_paths = list_files(args.folders)
+    manifest = None if args.dry_run else get_manifest()
+    keyword_index = None if args.dry_run else get_keyword_index()
+    stats = run_bulk_ingest(file_paths,
+                            partial(load_records, template=template),
+                            embedder,
+                            astra_vector_store,
+                            batch_size=args.batch_size,
+                            max_in_flight=args.in_flight,
+                            parse_workers=args.parse_workers,
+                            write_batch=write_batch,
+                            manifest=manifest,
+                            keyword_index=keyword_index,
+                            full=args.full,
+                            progress=lambda progress: print(f'\r{progress}', end='', flush=True))
+    print(f'\r{stats}')
+    if manifest:
+        for source in prune_sources(astra_vector_store, file_paths, prefixes=args.folders, manifest=manifest):
+            print(f'Removed {source}')
+    for source, error in stats.errors:
+        print(f'Failed {source}: {error}')
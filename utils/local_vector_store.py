@@ -0,0 +1,279 @@
+import json
+import math
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers in other processes are not excluded
+    fcntl = None
+
+
+class LocalVectorStore(VectorStore):
+    # On-disk alternative to the Astra/Cassandra table for offline use and tests. Rows are appended to
+    # vectors.f32 (raw, L2-normalised float32, memory-mapped for search) and records.jsonl (id, text, metadata);
+    # deletions are tombstones in deleted.jsonl. These files are only ever appended to, so other processes can
+    # follow them. Once the store holds train_threshold rows an IVF index is trained (spherical k-means, about
+    # sqrt(n) lists) and queries only scan the nprobe lists closest to the query. Smaller stores, and searches with
+    # exact=True, scan every row. Every write holds an flock on write.lock, as the app and the bulk loader may write
+    # to the same store from different processes.
+    def __init__(self, embedding, path=".cache/local_index", nprobe=8, train_threshold=4096):
+        self.embedding = embedding
+        self.path = path
+        self.nprobe = nprobe
+        self.train_threshold = train_threshold
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+
+        self._ids, self._texts, self._metadatas = [], [], []
+        self._rows = {}
+        self._deleted = set()
+        self._dim = None
+        self._vectors = None
+        self._centroids = None
+        self._lists = None
+        self._list_arrays = {}
+        self._trained_rows = 0
+        self._records_offset = 0
+        self._deleted_offset = 0
+        self._ivf_mtime = None
+        self._refresh()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self):
+        # Thread lock for this process, file lock against other processes. Once both are held, the files are
+        # re-read, so row numbers are assigned after every other writer's rows, and whatever a writer that died
+        # half-way left behind (vectors without records, a partial record line) is cut off.
+        with self._lock:
+            with open(self._file("write.lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if self._dim is None and os.path.exists(self._file("index.json")):
+                        with open(self._file("index.json"), encoding="utf-8") as f:
+                            self._dim = json.load(f)["dim"]
+                    self._refresh()
+                    self._truncate_partial_writes()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _truncate_partial_writes(self):
+        for name, size in [("records.jsonl", self._records_offset), ("deleted.jsonl", self._deleted_offset),
+                           ("vectors.f32", len(self._ids) * 4 * (self._dim or 0))]:
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                os.truncate(self._file(name), size)
+        if self._vectors is not None and len(self._vectors) > len(self._ids):
+            self._map_vectors()
+
+    def _read_new_lines(self, name, offset):
+        # Complete lines appended to name since offset, and the offset to resume from next time.
+        if not os.path.exists(self._file(name)) or os.path.getsize(self._file(name)) <= offset:
+            return [], offset
+        with open(self._file(name), "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        return [json.loads(line) for line in data[:end].splitlines()], offset + end
+
+    def _refresh(self):
+        # Picks up rows written since the files were last read, by this store or by another process such as the
+        # bulk loader, so a running app sees new data without a restart.
+        records, self._records_offset = self._read_new_lines("records.jsonl", self._records_offset)
+        deleted, self._deleted_offset = self._read_new_lines("deleted.jsonl", self._deleted_offset)
+        start = len(self._ids)
+        for record in records:
+            self._append_record(record["id"], record["text"], record["metadata"])
+        for row in deleted:
+            self._deleted.add(row)
+            if self._rows.get(self._ids[row]) == row:
+                del self._rows[self._ids[row]]
+        if records:
+            if self._dim is None:
+                with open(self._file("index.json"), encoding="utf-8") as f:
+                    self._dim = json.load(f)["dim"]
+            self._map_vectors()
+        if os.path.exists(self._file("ivf.npz")) and os.path.getmtime(self._file("ivf.npz")) != self._ivf_mtime:
+            self._ivf_mtime = os.path.getmtime(self._file("ivf.npz"))
+            ivf = np.load(self._file("ivf.npz"))
+            self._centroids = ivf["centroids"]
+            self._trained_rows = len(ivf["assignments"])
+            self._lists = [[] for _ in range(len(self._centroids))]
+            self._list_arrays = {}
+            for row, assignment in enumerate(ivf["assignments"]):
+                self._lists[assignment].append(row)
+            self._assign(range(self._trained_rows, len(self._ids)))
+        else:
+            self._assign(range(start, len(self._ids)))
+
+    def _map_vectors(self):
+        rows = os.path.getsize(self._file("vectors.f32")) // (4 * self._dim)
+        self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(rows, self._dim))
+
+    def _append_record(self, row_id, text, metadata):
+        if row_id in self._rows:
+            self._deleted.add(self._rows[row_id])
+        self._rows[row_id] = len(self._ids)
+        self._ids.append(row_id)
+        self._texts.append(text)
+        self._metadatas.append(metadata)
+
+    def _assign(self, rows):
+        rows = list(rows)
+        if self._centroids is None:
+            return
+        for start in range(0, len(rows), 65536):
+            batch = rows[start:start + 65536]
+            assignments = np.argmax(self._vectors[batch] @ self._centroids.T, axis=1)
+            for row, assignment in zip(batch, assignments):
+                self._lists[assignment].append(row)
+                self._list_arrays.pop(int(assignment), None)
+
+    def _train(self, iterations=10, sample_size=20000, seed=0):
+        live = np.array([row for row in range(len(self._ids)) if row not in self._deleted])
+        nlist = max(16, int(math.sqrt(len(live))))
+        rng = np.random.default_rng(seed)
+        sample = self._vectors[np.sort(rng.choice(live, size=min(sample_size, len(live)), replace=False))]
+        nlist = min(nlist, len(sample))
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignments == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self._centroids = centroids
+        self._lists = [[] for _ in range(nlist)]
+        self._list_arrays = {}
+        self._assign(range(len(self._ids)))
+        self._trained_rows = len(self._ids)
+        assignments = np.zeros(len(self._ids), dtype=np.int32)
+        for c, rows in enumerate(self._lists):
+            assignments[rows] = c
+        with open(self._file("ivf.npz.tmp"), "wb") as f:
+            np.savez(f, centroids=centroids, assignments=assignments)
+        os.replace(self._file("ivf.npz.tmp"), self._file("ivf.npz"))
+        self._ivf_mtime = os.path.getmtime(self._file("ivf.npz"))
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._write_lock():
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                with open(self._file("index.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self._dim}, f)
+            # Vectors are written before their records, so a reader never sees a record without its vector.
+            with open(self._file("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._file("records.jsonl"), "a", encoding="utf-8") as f:
+                for row_id, text, metadata in zip(ids, texts, metadatas):
+                    f.write(json.dumps({"id": row_id, "text": text, "metadata": metadata or {}}) + "\n")
+            self._refresh()
+            # Train once the store is large enough and retrain whenever it has grown 4x since, so that the lists
+            # stay balanced; in between, new rows join the list of their nearest centroid.
+            if self._centroids is None:
+                needs_training = len(self._ids) - len(self._deleted) >= self.train_threshold
+            else:
+                needs_training = len(self._ids) >= 4 * self._trained_rows
+            if needs_training:
+                self._train()
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids=None, **kwargs):
+        with self._write_lock():
+            rows = [self._rows[row_id] for row_id in ids or [] if row_id in self._rows]
+            with open(self._file("deleted.jsonl"), "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(f"{row}\n")
+            self._refresh()
+        return True
+
+    def _candidates(self, vector, nprobe, exact):
+        if self._centroids is None or exact:
+            return None
+        probes = np.argsort(-(self._centroids @ vector))[:nprobe]
+        arrays = []
+        for c in probes:
+            c = int(c)
+            if c not in self._list_arrays:
+                self._list_arrays[c] = np.asarray(self._lists[c], dtype=np.int64)
+            arrays.append(self._list_arrays[c])
+        return np.concatenate(arrays) if arrays else np.arange(0)
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, nprobe=None, exact=False, **kwargs):
+        with self._lock:
+            self._refresh()
+            if not self._ids:
+                return []
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            candidates = self._candidates(vector, nprobe or self.nprobe, exact)
+            if candidates is None:
+                scores = self._vectors[:len(self._ids)] @ vector
+            else:
+                scores = self._vectors[candidates] @ vector
+
+            def collect(order):
+                results = []
+                for i in order:
+                    row = int(i) if candidates is None else int(candidates[i])
+                    if row in self._deleted:
+                        continue
+                    metadata = self._metadatas[row]
+                    if filter and any(metadata.get(key) != value for key, value in filter.items()):
+                        continue
+                    results.append((Document(page_content=self._texts[row], metadata=metadata), float(scores[i])))
+                    if len(results) >= k:
+                        break
+                return results
+
+            # Partial sort of the best few candidates; only if tombstones or the filter discard too many of them
+            # do we fall back to ordering everything.
+            limit = max(10 * k, 100)
+            if len(scores) <= limit:
+                return collect(np.argsort(-scores))
+            top = np.argpartition(-scores, limit)[:limit]
+            results = collect(top[np.argsort(-scores[top])])
+            return results if len(results) >= k else collect(np.argsort(-scores))
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter, **kwargs)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] mapped to [0, 1].
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from utils.bm25_index import get_keyword_index
+from utils.registry import get_resource
+
+# Records, for every ingested source (uploaded file contents, scraped URL, corpus file path), the hash of its content
+# and the ids of the chunks written for it. Chunk ids are derived from the source and the chunk text, so the same
+# chunk always maps to the same row: re-ingesting a source only writes chunks that are new and deletes chunks that
+# disappeared, and re-writing a chunk after an interrupted run is an idempotent upsert.
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upload_source(name):
+    # Uploads are keyed by file name, so uploading a new version of a file replaces the chunks of the old one; the
+    # content hash is only the digest that tells an unchanged upload apart. The prefix keeps them apart from corpus
+    # file paths and URLs.
+    return f"upload:{name}"
+
+
+def chunk_id(source, text):
+    return hashlib.sha256(f"{source}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class Manifest:
+    def __init__(self, path=".cache/manifest.sqlite3"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sources ("
+                           "source TEXT PRIMARY KEY, content_hash TEXT, updated REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                           "source TEXT NOT NULL, chunk_id TEXT NOT NULL, PRIMARY KEY (source, chunk_id))")
+        self._conn.commit()
+
+    def is_unchanged(self, source, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash FROM sources WHERE source = ?", (source,)).fetchone()
+        return row is not None and digest is not None and row[0] == digest
+
+    def chunk_ids(self, source):
+        with self._lock:
+            rows = self._conn.execute("SELECT chunk_id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return {row[0] for row in rows}
+
+    def sources(self):
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT source FROM sources")}
+
+    def version(self):
+        # Changes whenever any source is recorded or forgotten, by this process or another one (e.g. the bulk
+        # loader), which lets caches of answers derived from the index notice that the corpus changed.
+        with self._lock:
+            return tuple(self._conn.execute("SELECT COUNT(*), MAX(updated) FROM sources").fetchone())
+
+    def record(self, source, digest, chunk_ids):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.executemany("INSERT INTO chunks (source, chunk_id) VALUES (?, ?)",
+                                   [(source, cid) for cid in chunk_ids])
+            self._conn.execute("INSERT OR REPLACE INTO sources (source, content_hash, updated) VALUES (?, ?, ?)",
+                               (source, digest, time.time()))
+            self._conn.commit()
+
+    # Incremental variant of chunk_ids/record for sync_source. The ids seen during a sync are staged in a temporary
+    # table rather than held in memory, so syncing a very large source keeps memory flat.
+    def start_sync(self, source):
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS staged ("
+                               "source TEXT NOT NULL, chunk_id TEXT NOT NULL, PRIMARY KEY (source, chunk_id))")
+            self._conn.execute("DELETE FROM staged WHERE source = ?", (source,))
+
+    def stage(self, source, chunk_ids):
+        # Returns the ids that are neither repeated within this sync nor already recorded for the source, and the
+        # number of ids that were already recorded.
+        fresh = []
+        with self._lock:
+            for cid in chunk_ids:
+                if self._conn.execute("INSERT OR IGNORE INTO staged (source, chunk_id) VALUES (?, ?)",
+                                      (source, cid)).rowcount:
+                    fresh.append(cid)
+            if fresh:
+                known = {row[0] for row in self._conn.execute(
+                    f"SELECT chunk_id FROM chunks WHERE source = ? AND chunk_id IN ({','.join('?' * len(fresh))})",
+                    [source, *fresh])}
+                fresh = [cid for cid in fresh if cid not in known]
+                return fresh, len(known)
+        return fresh, 0
+
+    def unstaged(self, source):
+        # Recorded ids of the source that the current sync has not seen.
+        with self._lock:
+            return {row[0] for row in self._conn.execute(
+                "SELECT chunk_id FROM chunks WHERE source = ? AND chunk_id NOT IN "
+                "(SELECT chunk_id FROM staged WHERE source = ?)", (source, source))}
+
+    def finish_sync(self, source, digest):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("INSERT INTO chunks (source, chunk_id) SELECT source, chunk_id FROM staged "
+                               "WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM staged WHERE source = ?", (source,))
+            self._conn.execute("INSERT OR REPLACE INTO sources (source, content_hash, updated) VALUES (?, ?, ?)",
+                               (source, digest, time.time()))
+            self._conn.commit()
+
+    def forget(self, source):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            self._conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+            self._conn.commit()
+
+
+def get_manifest(path=".cache/manifest.sqlite3"):
+    return get_resource(("manifest", path), lambda: Manifest(path))
+
+
+class SyncResult:
+    def __init__(self, source, skipped=False, added=0, removed=0, kept=0):
+        self.source = source
+        self.skipped = skipped
+        self.added = added
+        self.removed = removed
+        self.kept = kept
+
+    def __str__(self):
+        if self.skipped:
+            return f"{self.source}: unchanged"
+        return f"{self.source}: {self.added} added, {self.removed} removed, {self.kept} unchanged"
+
+
+def sync_source(astra_vector_store, source, chunks, digest=None, manifest=None, keyword_index=None, batch_size=64,
+                progress=None):
+    # chunks is an iterable of (text, metadata). It is consumed once, so it may be a generator. The keyword index
+    # of the hybrid retriever is kept in step with the vector store. progress(stage, count), if given, is called as
+    # each batch is embedded and written, and for chunks that were already indexed ("kept").
+    manifest = manifest or get_manifest()
+    keyword_index = get_keyword_index() if keyword_index is None else keyword_index
+    if manifest.is_unchanged(source, digest):
+        return SyncResult(source, skipped=True)
+
+    manifest.start_sync(source)
+    result = SyncResult(source)
+    batch = []
+
+    def flush():
+        fresh, known = manifest.stage(source, [cid for cid, _, _ in batch])
+        result.kept += known
+        if progress is not None and known:
+            progress("kept", known)
+        fresh = set(fresh)
+        new = []
+        for cid, text, metadata in batch:
+            if cid in fresh:
+                fresh.discard(cid)
+                new.append((cid, text, metadata))
+        batch.clear()
+        if not new:
+            return
+        ids = [cid for cid, _, _ in new]
+        texts = [text for _, text, _ in new]
+        metadatas = [metadata for _, _, metadata in new]
+        if progress is None:
+            astra_vector_store.add_texts(texts, metadatas, ids=ids)
+        else:
+            # Same writes as add_texts, with the embedding step split out so it can be reported.
+            from utils.initialize_vector_store import add_embeddings
+            vectors = astra_vector_store.embeddings.embed_documents(texts)
+            progress("embedded", len(texts))
+            add_embeddings(astra_vector_store, texts, vectors, metadatas, ids)
+            progress("written", len(texts))
+        keyword_index.add(ids, texts, metadatas)
+        result.added += len(texts)
+
+    for text, metadata in chunks:
+        batch.append((chunk_id(source, text), text, metadata))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    removed = manifest.unstaged(source)
+    if removed:
+        astra_vector_store.delete(list(removed))
+        keyword_index.delete(removed)
+        result.removed = len(removed)
+    # Only recorded once every write went through; an interrupted sync is simply redone next time.
+    manifest.finish_sync(source, digest)
+    return result
+
+
+def prune_sources(astra_vector_store, present, prefixes=None, manifest=None, keyword_index=None):
+    # Remove the chunks of sources that no longer exist, e.g. corpus files deleted since the last refresh.
+    # prefixes restricts pruning to sources under the folders that were actually scanned.
+    manifest = manifest or get_manifest()
+    keyword_index = get_keyword_index() if keyword_index is None else keyword_index
+    pruned = []
+    for source in manifest.sources() - set(present):
+        if prefixes and not any(source.startswith(prefix) for prefix in prefixes):
+            continue
+        ids = manifest.chunk_ids(source)
+        if ids:
+            astra_vector_store.delete(list(ids))
+            keyword_index.delete(ids)
+        manifest.forget(source)
+        pruned.append(source)
+    return pruned
@@ -0,0 +1,49 @@
+import threading
+
+# Process-wide cache shared by every Streamlit session. Streamlit re-executes the page script on every
+# interaction, so anything expensive (cassio session, embeddings client, LLM clients, chains) is built
+# once here and looked up on reruns.
+_resources = {}
+_key_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _lock_for(key):
+    with _registry_lock:
+        if key not in _key_locks:
+            _key_locks[key] = threading.Lock()
+        return _key_locks[key]
+
+
+def get_resource(key, build):
+    if key in _resources:
+        return _resources[key]
+    # One lock per key so that a slow build for one model does not block lookups for another.
+    with _lock_for(key):
+        if key not in _resources:
+            _resources[key] = build()
+        return _resources[key]
+
+
+def get_vector_store(astra_db_application_token, astra_db_id, backend="astra"):
+    from utils.initialize_vector_store import initialize_vector_store
+
+    key = ("vector_store", backend, astra_db_application_token, astra_db_id)
+    return get_resource(key, lambda: initialize_vector_store(astra_db_application_token, astra_db_id, backend))
+
+
+def get_chain(create_chain, astra_vector_store, *args, **kwargs):
+    key = ("chain", create_chain.__name__, id(astra_vector_store), args, tuple(sorted(kwargs.items())))
+    return get_resource(key, lambda: create_chain(astra_vector_store, *args, **kwargs))
+
+
+def invalidate(kind=None):
+    # kind=None drops everything; otherwise only entries whose key starts with kind ("vector_store",
+    # "chain", ...). Dropping a vector store also drops everything built on top of it.
+    with _registry_lock:
+        if kind is None or kind == "vector_store":
+            keys = list(_resources)
+        else:
+            keys = [key for key in _resources if key[0] == kind]
+        for key in keys:
+            _resources.pop(key, None)
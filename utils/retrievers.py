@@ -0,0 +1,146 @@
+import asyncio
+import time
+from typing import Any, Dict, List
+
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableLambda
+
+from utils.bm25_index import get_keyword_index
+from utils.manifest import content_hash
+from utils.rewrite_gate import needs_rewrite, rewrite_stats
+from utils.tracing import record_stages
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    # rankings is a list of document lists, best first. Documents are matched across rankings by content, since
+    # the dense store and the keyword index return separate Document objects for the same chunk.
+    scores, documents = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = content_hash(doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(key, doc)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [documents[key] for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    # Dense search in the vector store plus BM25 over the same chunks, fused with reciprocal rank fusion. Exact
+    # terms such as drug names or ICD codes that embeddings tend to blur are found by the keyword side; with an
+    # empty keyword index this is plain dense search. With a reranker, the fetch_k best fused candidates are
+    # reranked and the top k kept; with a packer, the k chunks are fitted into its token budget. Per-stage timings
+    # become child spans of the retriever's run when a TraceHandler is among its callbacks.
+    vectorstore: Any
+    keyword_index: Any
+    reranker: Any = None
+    packer: Any = None
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+    search_kwargs: Dict[str, Any] = {}
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        timings = {}
+        started = time.perf_counter()
+        keyword = [doc for doc, _ in self.keyword_index.search(query, k=self.fetch_k)]
+        dense = self.vectorstore.similarity_search(query, k=self.fetch_k, **self.search_kwargs)
+        documents = reciprocal_rank_fusion([dense, keyword], self.fetch_k if self.reranker else self.k, self.rrf_k)
+        timings["retrieval"] = time.perf_counter() - started
+        documents = _finish(query, documents, self.k, self.reranker, self.packer, timings)
+        timings["total"] = time.perf_counter() - started
+        record_stages(run_manager, timings)
+        return documents
+
+
+def _finish(query, documents, k, reranker, packer, timings):
+    if reranker:
+        started = time.perf_counter()
+        documents = reranker.rerank(query, documents, k)
+        timings["rerank"] = time.perf_counter() - started
+    if packer:
+        started = time.perf_counter()
+        documents = packer.pack(query, documents)
+        timings["packing"] = time.perf_counter() - started
+    return documents
+
+
+def build_retriever(astra_vector_store, k=4, packer=None, reranker=None, **kwargs):
+    return HybridRetriever(vectorstore=astra_vector_store, keyword_index=get_keyword_index(), packer=packer,
+                           reranker=reranker, k=k, **kwargs)
+
+
+class FanOutRetriever:
+    # Retrieval stage of the history-aware chain. Dense and keyword searches for the user's own words start at once,
+    # concurrently with the LLM rewrite of the question (skipped when the question does not refer back to the
+    # conversation); dense and keyword searches for the rewritten question start together as soon as it arrives. The
+    # keyword search runs in a worker thread, so it overlaps the dense search. Every ranking is then merged,
+    # deduplicated by content hash and reranked with reciprocal rank fusion. Reranking, packing and the traced
+    # per-stage timings work as in HybridRetriever, against the rewritten question when there is one.
+    def __init__(self, astra_vector_store, keyword_index, llm, prompt, name="fan_out", reranker=None, packer=None, k=4,
+                 fetch_k=20, rrf_k=60):
+        self.vectorstore = astra_vector_store
+        self.keyword_index = keyword_index
+        self.reranker = reranker
+        self.packer = packer
+        self.rewrite_chain = (prompt | llm | StrOutputParser()).with_config(run_name="rewrite")
+        self.k = k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.name = name
+
+    async def _timed(self, timings, stage, call, *args):
+        started = time.perf_counter()
+        try:
+            return await call(*args)
+        finally:
+            timings[stage] = time.perf_counter() - started
+
+    def _searches(self, timings, variant, query):
+        return [
+            self._timed(timings, f"dense:{variant}", self.vectorstore.asimilarity_search, query, self.fetch_k),
+            self._timed(timings, f"keyword:{variant}", asyncio.to_thread, self._keyword_search, query),
+        ]
+
+    def _keyword_search(self, query):
+        return [doc for doc, _ in self.keyword_index.search(query, k=self.fetch_k)]
+
+    async def aretrieve(self, inputs, config=None):
+        timings = {}
+        started = time.perf_counter()
+        query = standalone = inputs["input"]
+        searches = self._searches(timings, "original", query)
+        if needs_rewrite(query, inputs.get("chat_history")):
+            async def rewritten():
+                nonlocal standalone
+                rewrite = await self._timed(timings, "rewrite", self.rewrite_chain.ainvoke, inputs, config)
+                rewrite_stats.record_rewrite(timings["rewrite"])
+                standalone = rewrite
+                if rewrite.strip() == query.strip():
+                    return []
+                return await asyncio.gather(*self._searches(timings, "rewritten", rewrite))
+            *rankings, extra = await asyncio.gather(*searches, rewritten())
+            rankings += extra
+        else:
+            if inputs.get("chat_history"):
+                rewrite_stats.record_skip()
+            rankings = await asyncio.gather(*searches)
+
+        fused = time.perf_counter()
+        documents = reciprocal_rank_fusion(rankings, self.fetch_k if self.reranker else self.k, self.rrf_k)
+        timings["fusion"] = time.perf_counter() - fused
+        documents = _finish(standalone, documents, self.k, self.reranker, self.packer, timings)
+        timings["total"] = time.perf_counter() - started
+        record_stages((config or {}).get("callbacks"), timings)
+        return documents
+
+    def retrieve(self, inputs, config=None):
+        return asyncio.run(self.aretrieve(inputs, config))
+
+    def as_runnable(self):
+        return RunnableLambda(self.retrieve, afunc=self.aretrieve, name=self.name)
+
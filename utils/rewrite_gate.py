@@ -0,0 +1,66 @@
+import re
+import threading
+
+# Local check that decides whether a follow-up question has to be rewritten into a standalone one by the LLM before
+# retrieval. Most questions are self-contained ("What are the symptoms of asthma?") and can be searched as typed;
+# only those that lean on the conversation ("What about its treatment?", "and in children?") need the extra call.
+_WORD = re.compile(r"[a-z0-9']+")
+
+REFERENCE_WORDS = frozenset(
+    "it its it's itself they them their theirs themselves this that these those he him his she her hers there such "
+    "same former latter above previous earlier aforementioned else another other others one ones both either neither "
+    "also too again".split())
+_FOLLOW_UP_OPENER = re.compile(r"^(?:and|but|or|so|then|what about|how about|what else|why not|tell me more|more|"
+                               r"continue|go on|ok|okay|yes|no)\b")
+FILLER_WORDS = frozenset(
+    "a an the is are was were be do does did can could should would will what which who whom how why when where of "
+    "in on for to with and or about me i my you your please tell give show list".split())
+
+
+def needs_rewrite(question, chat_history):
+    # chat_history is HistoryManager.messages(): the summary and the earlier turns, never the question being asked.
+    if not chat_history:
+        return False
+    text = question.strip().lower()
+    if _FOLLOW_UP_OPENER.match(text):
+        return True
+    words = _WORD.findall(text)
+    if any(word in REFERENCE_WORDS for word in words):
+        return True
+    # Fragments such as "symptoms?" or "in children?" only make sense together with the previous turn.
+    return sum(word not in FILLER_WORDS for word in words) < 2
+
+
+class RewriteStats:
+    # Counts gate decisions. The time saved by a skipped rewrite is estimated from the mean duration of the rewrites
+    # that did run.
+    def __init__(self):
+        self.skipped = 0
+        self.rewritten = 0
+        self.rewrite_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def record_rewrite(self, elapsed):
+        with self._lock:
+            self.rewritten += 1
+            self.rewrite_seconds += elapsed
+
+    @property
+    def mean_rewrite_seconds(self):
+        return self.rewrite_seconds / self.rewritten if self.rewritten else 0.0
+
+    @property
+    def saved_seconds(self):
+        return self.skipped * self.mean_rewrite_seconds
+
+    def __str__(self):
+        total = self.skipped + self.rewritten
+        return (f"{self.skipped} of {total} rewrites skipped, about {self.saved_seconds:.1f}s saved "
+                f"({self.mean_rewrite_seconds * 1000:.0f} ms per rewrite)")
+
+
+rewrite_stats = RewriteStats()
@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain.chains.conversational_retrieval.base import _get_chat_history
+
+from utils.manifest import get_manifest
+from utils.registry import get_resource
+from utils.rewrite_gate import needs_rewrite, rewrite_stats
+from utils.tracing import traced
+
+
+class CachedAnswer:
+    def __init__(self, question, vector, answer, source_documents):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.source_documents = source_documents
+        self.created = time.time()
+
+
+class SemanticCache:
+    # Answers keyed by the embedding of the standalone question. A lookup returns the stored answer of the most
+    # similar earlier question if the cosine similarity reaches the threshold. Entries live in one LRU namespace per
+    # model, expire after ttl seconds, and are all dropped when the indexed corpus changes (tracked through the
+    # ingestion manifest).
+    def __init__(self, embedding, threshold=0.95, ttl=24 * 3600, max_entries=1024, manifest=None):
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.manifest = manifest or get_manifest()
+        self.hits = 0
+        self.misses = 0
+        self._namespaces = {}
+        self._matrices = {}
+        self._corpus_version = self.manifest.version()
+        self._lock = threading.RLock()
+
+    def _embed(self, question):
+        vector = np.asarray(self.embedding.embed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _check_corpus(self):
+        version = self.manifest.version()
+        if version != self._corpus_version:
+            self._corpus_version = version
+            self.invalidate()
+
+    def _entries(self, namespace):
+        entries = self._namespaces.setdefault(namespace, OrderedDict())
+        expired = [key for key, entry in entries.items() if time.time() - entry.created > self.ttl]
+        for key in expired:
+            del entries[key]
+        if expired:
+            self._matrices.pop(namespace, None)
+        return entries
+
+    def lookup(self, namespace, question):
+        vector = self._embed(question)
+        with self._lock:
+            self._check_corpus()
+            entries = self._entries(namespace)
+            if entries:
+                if namespace not in self._matrices:
+                    self._matrices[namespace] = (list(entries), np.stack([e.vector for e in entries.values()]))
+                keys, matrix = self._matrices[namespace]
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return entries[keys[best]], vector
+            self.misses += 1
+            return None, vector
+
+    def store(self, namespace, question, answer, source_documents, vector=None):
+        vector = self._embed(question) if vector is None else vector
+        with self._lock:
+            entries = self._entries(namespace)
+            entries[question] = CachedAnswer(question, vector, answer, source_documents)
+            entries.move_to_end(question)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._matrices.pop(namespace, None)
+
+    def invalidate(self, namespace=None):
+        with self._lock:
+            for name in ([namespace] if namespace is not None else list(self._namespaces)):
+                self._namespaces.pop(name, None)
+                self._matrices.pop(name, None)
+
+
+def get_semantic_cache(astra_vector_store):
+    return get_resource(("semantic_cache", id(astra_vector_store)),
+                        lambda: SemanticCache(astra_vector_store.embeddings))
+
+
+def cached_conversational_answer(chain, semantic_cache, namespace, question, chat_history, callbacks=None,
+                                 router=None):
+    # The cache is keyed by the standalone question, so follow-ups are condensed first, exactly as
+    # ConversationalRetrievalChain would. The chain is then called with the standalone question and no history,
+    # which is equivalent because the answer prompt only sees the question and the retrieved context.
+    # Self-contained questions are used as typed; only follow-ups that refer back to the conversation pay for the
+    # condensing LLM call.
+    # Small talk and off-topic questions are answered from the router's templates; like cache hits, they never run
+    # the chain and are reported as cached.
+    # Steps outside the chain are traced as spans of their own when a TraceHandler is among the callbacks.
+    with traced(callbacks, "intent_router"):
+        routed = router.route(question, chat_history) if router else None
+    if routed:
+        return {"question": question, "answer": routed[1], "source_documents": [], "cached": True, "intent": routed[0]}
+    standalone_question = question
+    if needs_rewrite(question, chat_history):
+        get_chat_history = chain.get_chat_history or _get_chat_history
+        started = time.perf_counter()
+        inputs = {"question": question, "chat_history": get_chat_history(chat_history)}
+        config = {"callbacks": callbacks, "run_name": "condense_question"}
+        standalone_question = chain.question_generator.invoke(inputs, config)[chain.question_generator.output_key]
+        rewrite_stats.record_rewrite(time.perf_counter() - started)
+    elif chat_history:
+        rewrite_stats.record_skip()
+    with traced(callbacks, "semantic_cache_lookup"):
+        cached, vector = semantic_cache.lookup(namespace, standalone_question)
+    if cached:
+        return {
+            "question": question,
+            "answer": cached.answer,
+            "source_documents": cached.source_documents,
+            "cached": True,
+        }
+    response_data = chain({"question": standalone_question, "chat_history": []}, callbacks=callbacks)
+    semantic_cache.store(namespace, standalone_question, response_data["answer"],
+                         response_data.get("source_documents", []), vector)
+    return {**response_data, "question": question, "cached": False}
@@ -0,0 +1,39 @@
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class StreamHandler(BaseCallbackHandler):
+    # Every update re-sends the whole answer, so rendering on every token floods the websocket. Tokens are buffered
+    # and the container is only updated every flush_interval seconds or flush_size tokens, plus once when the LLM
+    # finishes; this divides the renders, and the text serialised and sent, by the tokens per flush. The handler's
+    # own CPU time is about the same either way (see benchmarks/stream_render.py).
+    def __init__(self, container, initial_text="", flush_interval=0.05, flush_size=64, clock=time.monotonic):
+        self.container = container
+        self.text = initial_text
+        self.pending = []
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.renders = 0
+        self._clock = clock
+        self._last_flush = clock()
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.pending.append(token)
+        if len(self.pending) >= self.flush_size or self._clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        self.flush()
+
+    def on_llm_error(self, error, **kwargs) -> None:
+        self.flush()
+
+    def flush(self):
+        self._last_flush = self._clock()
+        if not self.pending:
+            return
+        self.text += "".join(self.pending)
+        self.pending.clear()
+        self.container.markdown(self.text)
+        self.renders += 1
@@ -0,0 +1,266 @@
+import json
+import math
+import os
+import re
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+
+from utils.context_packer import count_tokens
+from utils.registry import get_resource
+
+# Runnables that only move data between the stages. They are still exported, but they do not name a stage and are
+# left out of stage paths, so that "ConversationalRetrievalChain/StuffDocumentsChain/LLMChain/ChatOpenAI" is not
+# buried under RunnableSequence/RunnableParallel/... segments.
+_PLUMBING = re.compile(r"^(Runnable|<lambda>)|(PromptTemplate|OutputParser)$")
+# Retriever timings that are already spans of their own.
+_TRACED_TIMINGS = {"total", "rewrite"}
+
+
+class StageStats:
+    # Durations of the most recent spans of each stage, for the p50 / p95 figures on the pages.
+    def __init__(self, window=256):
+        self.window = window
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._durations.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def latencies(self):
+        # stage -> (p50, p95, count) in seconds, slowest p95 first.
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._durations.items()}
+        table = {stage: (statistics.median(values), values[math.ceil(0.95 * len(values)) - 1], len(values))
+                 for stage, values in samples.items()}
+        return dict(sorted(table.items(), key=lambda item: item[1][1], reverse=True))
+
+
+stage_stats = StageStats()
+
+
+class JSONLSink:
+    # One span per line, with OpenTelemetry's span field names (traceId, spanId, parentSpanId, startTimeUnixNano,
+    # endTimeUnixNano, attributes, status), so the file can be replayed into an OTLP collector.
+    def __init__(self, path=".cache/traces.jsonl"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+def _count_documents(values):
+    if not isinstance(values, dict):
+        return None
+    for key in ("source_documents", "context", "input_documents"):
+        documents = values.get(key)
+        if isinstance(documents, list) and documents and isinstance(documents[0], Document):
+            return len(documents)
+    return None
+
+
+class TraceHandler(BaseCallbackHandler):
+    # Records a span for every chain, LLM, retriever and tool run it is passed to, with wall time, token counts and
+    # document counts. A trace is exported to the sink when its root run ends, and each named span's duration is
+    # added to stage_stats under its stage path (the names of its non-plumbing ancestors and its own). One handler is
+    # shared by every session; runs are told apart by run id.
+    run_inline = True
+
+    def __init__(self, sink=None, stats=stage_stats, model_name="gpt-4-turbo-preview"):
+        self.sink = sink
+        self.stats = stats
+        self.model_name = model_name
+        self._spans = {}
+        self._traces = {}
+        self._lock = threading.Lock()
+
+    def _start(self, kind, serialized, run_id, parent_run_id, name=None, **attributes):
+        serialized = serialized or {}
+        name = name or serialized.get("name") or (serialized.get("id") or [kind])[-1]
+        with self._lock:
+            parent = self._spans.get(parent_run_id)
+            trace_id = parent["traceId"] if parent else run_id.hex
+            path = parent["attributes"]["stage"] if parent else ""
+            if not parent or not _PLUMBING.search(name):
+                path = f"{path}/{name}" if path else name
+            span = {
+                "traceId": trace_id,
+                "spanId": run_id.hex[:16],
+                "parentSpanId": parent["spanId"] if parent else None,
+                "name": name,
+                "kind": kind,
+                "startTimeUnixNano": time.time_ns(),
+                "endTimeUnixNano": None,
+                "attributes": {"stage": path, **{key: value for key, value in attributes.items() if value is not None}},
+                "status": {"code": "OK"},
+                "_started": time.perf_counter(),
+                "_named": not _PLUMBING.search(name),
+            }
+            self._spans[run_id] = span
+            self._traces.setdefault(trace_id, []).append(span)
+
+    def _end(self, run_id, error=None, **attributes):
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+            if span is None:
+                return
+            seconds = time.perf_counter() - span.pop("_started")
+            span["endTimeUnixNano"] = span["startTimeUnixNano"] + int(seconds * 1e9)
+            span["attributes"].update({key: value for key, value in attributes.items() if value is not None})
+            if error is not None:
+                span["status"] = {"code": "ERROR", "message": repr(error)}
+            if span.pop("_named"):
+                self.stats.record(span["attributes"]["stage"], seconds)
+            finished = None if span["parentSpanId"] else self._traces.pop(span["traceId"], [])
+        if finished and self.sink is not None:
+            self.sink.export(finished)
+
+    def add_stages(self, run_id, timings):
+        # Stages timed inside a run (the retrievers' dense and keyword searches, fusion, reranking, packing) become
+        # child spans of it. Only their durations are known, so they share the run's start time.
+        with self._lock:
+            parent = self._spans.get(run_id)
+            if parent is None:
+                return
+            for stage, seconds in timings.items():
+                if stage in _TRACED_TIMINGS:
+                    continue
+                path = f"{parent['attributes']['stage']}/{stage}"
+                self._traces[parent["traceId"]].append({
+                    "traceId": parent["traceId"],
+                    "spanId": uuid.uuid4().hex[:16],
+                    "parentSpanId": parent["spanId"],
+                    "name": stage,
+                    "kind": "stage",
+                    "startTimeUnixNano": parent["startTimeUnixNano"],
+                    "endTimeUnixNano": parent["startTimeUnixNano"] + int(seconds * 1e9),
+                    "attributes": {"stage": path},
+                    "status": {"code": "OK"},
+                })
+                self.stats.record(path, seconds)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # A root span around work that does not go through LangChain callbacks (semantic cache lookups, feedback).
+        run_id = uuid.uuid4()
+        self._start("stage", None, run_id, None, name=name, **attributes)
+        try:
+            yield
+        except Exception as e:
+            self._end(run_id, error=e)
+            raise
+        self._end(run_id)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, name=None, **kwargs):
+        self._start("chain", serialized, run_id, parent_run_id, name=name, documents=_count_documents(inputs))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, documents=_count_documents(outputs))
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, name=None, **kwargs):
+        self._start("llm", serialized, run_id, parent_run_id, name=name, _prompts=prompts)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, name=None, **kwargs):
+        prompts = ["\n".join(str(message.content) for message in batch) for batch in messages]
+        self._start("llm", serialized, run_id, parent_run_id, name=name, _prompts=prompts)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        # Streaming responses carry no token_usage; their tokens are counted locally.
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        with self._lock:
+            span = self._spans.get(run_id)
+            prompts = span["attributes"].pop("_prompts", []) if span else []
+        prompt_tokens = usage.get("prompt_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(prompt, self.model_name) for prompt in prompts)
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = sum(count_tokens(generation.text, self.model_name)
+                                    for generations in response.generations for generation in generations)
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            if run_id in self._spans:
+                self._spans[run_id]["attributes"].pop("_prompts", None)
+        self._end(run_id, error=error)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, name=None, **kwargs):
+        self._start("retriever", serialized, run_id, parent_run_id, name=name)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, name=None, **kwargs):
+        self._start("tool", serialized, run_id, parent_run_id, name=name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+
+def record_stages(callbacks, timings):
+    # callbacks is the retriever's run manager, or the child callback manager a RunnableLambda passes in its config;
+    # either way the stages belong to the run that owns it.
+    if callbacks is None:
+        return
+    run_id = getattr(callbacks, "run_id", None) or getattr(callbacks, "parent_run_id", None)
+    for handler in getattr(callbacks, "handlers", ()):
+        if isinstance(handler, TraceHandler):
+            handler.add_stages(run_id, timings)
+
+
+def find_tracer(callbacks):
+    for handler in callbacks or ():
+        if isinstance(handler, TraceHandler):
+            return handler
+    return None
+
+
+@contextmanager
+def traced(callbacks, name, **attributes):
+    tracer = find_tracer(callbacks)
+    if tracer is None:
+        yield
+        return
+    with tracer.span(name, **attributes):
+        yield
+
+
+def get_tracer(path=".cache/traces.jsonl"):
+    return get_resource(("tracer", path), lambda: TraceHandler(JSONLSink(path) if path else None))
+
+
+def show_stage_latencies(limit=12):
+    # Imported here so that the retrievers, the semantic cache and the feedback worker, which import this module,
+    # do not need streamlit (the bulk loader and the benchmarks run without it).
+    import streamlit as st
+
+    latencies = stage_stats.latencies()
+    if not latencies:
+        return
+    with st.expander("Stage Latency (p50 / p95)"):
+        rows = ["| stage | p50 | p95 | runs |", "|---|---|---|---|"]
+        for stage, (p50, p95, count) in list(latencies.items())[:limit]:
+            rows.append(f"| {stage} | {p50 * 1000:.0f} ms | {p95 * 1000:.0f} ms | {count} |")
+        st.markdown("\n".join(rows))